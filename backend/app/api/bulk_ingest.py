@@ -0,0 +1,252 @@
+"""
+Bulk loading of texts for POST /texts/bulk.
+
+Records are taken in chunks, every chunk is one transaction. Entities are resolved with one IN query
+per table and chunk and are remembered for the rest of the request, so an author or a keyword shared by
+many texts is looked up once. Rows are written with executemany, which psycopg2 turns into multi-row
+INSERT ... VALUES statements.
+"""
+import json
+import logging
+from collections import Counter
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException, Request, status
+from pydantic import ValidationError
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import Session
+
+from app.api import crud, models, schemas
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq")
+
+
+async def read_records(request: Request) -> AsyncIterator[Tuple[Optional[dict], str]]:
+    """
+    Accepts a JSON array or an NDJSON stream, NDJSON is parsed while the body is being received
+    return: pairs (raw record, error), a record which is not valid JSON has None and the error
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in NDJSON_TYPES:
+        try:
+            records = json.loads(await request.body())
+        except ValueError as err:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON: {err}")
+        if not isinstance(records, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array of texts"
+            )
+        for record in records:
+            yield record, ""
+        return
+
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_line(line)
+    if buffer.strip():
+        yield parse_line(buffer)
+
+
+def parse_line(line: bytes) -> Tuple[Optional[dict], str]:
+    try:
+        return json.loads(line), ""
+    except ValueError as err:
+        return None, f"Invalid JSON: {err}"
+
+
+class BulkIngest:
+    """
+    State of one bulk request: ids of entities resolved by previous chunks and ids of loaded texts
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.keywords: Dict[str, UUID] = {}
+        self.fos: Dict[str, UUID] = {}
+        self.orgs: Dict[str, UUID] = {}
+        self.authors: Set[UUID] = set()
+        self.texts: Set[UUID] = set()
+        self.records: List[schemas.BulkRecordStatus] = []
+
+    def ingest(self, chunk: List[Tuple[Optional[dict], str]]):
+        logging.info(f"{__name__} called")
+        first = len(self.records)
+        texts = []
+        for index, (raw, error) in enumerate(chunk, start=first):
+            record_status = schemas.BulkRecordStatus(index=index, id=None, status="invalid", detail=error)
+            self.records.append(record_status)
+            if raw is None:
+                continue
+            try:
+                text = schemas.TextBulkInput.parse_obj(raw)
+            except ValidationError as err:
+                record_status.detail = str(err)
+                continue
+            record_status.id = text.id
+            if text.id in self.texts:
+                record_status.status, record_status.detail = "exists", "Duplicate id in the request"
+                continue
+            self.texts.add(text.id)
+            texts.append((record_status, text))
+
+        try:
+            self.write(texts)
+            self.db.commit()
+        except Exception as err:
+            logging.exception(f"chunk of {len(chunk)} texts failed")
+            self.db.rollback()
+            # в кэшах могут быть id из откаченной транзакции
+            self.keywords, self.fos, self.orgs, self.authors = {}, {}, {}, set()
+            for record_status, text in texts:
+                self.texts.discard(text.id)
+                record_status.status, record_status.detail = "failed", str(err)
+
+    def write(self, texts: List[Tuple[schemas.BulkRecordStatus, schemas.TextBulkInput]]):
+        existing = self.existing_texts(text.id for _, text in texts)
+        new_texts = []
+        for record_status, text in texts:
+            if text.id in existing:
+                record_status.status, record_status.detail = "exists", "Text already exists"
+            else:
+                record_status.status = "created"
+                new_texts.append((record_status, text))
+        if not new_texts:
+            return
+        texts = [text for _, text in new_texts]
+
+        self.resolve_names(models.Keyword.__table__, self.keywords, [k for t in texts for k in t.keywords])
+        self.resolve_names(models.Fos.__table__, self.fos, [f for t in texts for f in t.fos])
+        self.resolve_authors([a for t in texts for a in t.authors])
+
+        self.db.execute(
+            models.Text.__table__.insert(),
+            [
+                {
+                    "id": text.id,
+                    "title": text.title,
+                    "year": text.year,
+                    "n_citation": text.n_citation,
+                    "abstract": text.abstract,
+                    "venue_name": text.venue_name,
+                }
+                for text in texts
+            ],
+        )
+        self.insert_links(models.text_keywords, "text_keywords_id", "keyword_id", texts,
+                          lambda text: [self.keywords[k.name] for k in text.keywords])
+        self.insert_links(models.text_fos, "text_fos_id", "fos_id", texts,
+                          lambda text: [self.fos[f.name] for f in text.fos])
+        self.insert_links(models.text_author, "author_keywords_id", "author_id", texts,
+                          lambda text: [a.id for a in text.authors])
+        self.insert_citations(new_texts)
+
+    def existing_texts(self, ids: Iterable[UUID]) -> Set[UUID]:
+        ids = list(ids)
+        if not ids:
+            return set()
+        text = models.Text.__table__
+        return set(self.db.execute(select(text.c.id).where(text.c.id.in_(ids))).scalars())
+
+    def resolve_names(self, table, cache: Dict[str, UUID], entities: list):
+        """
+        Adds ids of entities with a unique name to the cache, missing entities are inserted
+        """
+        names = {entity.name: entity.id for entity in entities if entity.name not in cache}
+        if not names:
+            return
+        cache.update(self.db.execute(select(table.c.name, table.c.id).where(table.c.name.in_(list(names)))).all())
+        missing = [name for name in names if name not in cache]
+        if missing:
+            crud.insert_ignore_conflicts(
+                self.db, table, [{"id": names[name], "name": name} for name in missing], ["name"]
+            )
+            cache.update(self.db.execute(select(table.c.name, table.c.id).where(table.c.name.in_(missing))).all())
+
+    def resolve_authors(self, authors: List[schemas.Author]):
+        new_authors = {author.id: author for author in authors if author.id not in self.authors}
+        if not new_authors:
+            return
+        table = models.Author.__table__
+        self.authors.update(
+            self.db.execute(select(table.c.id).where(table.c.id.in_(list(new_authors)))).scalars()
+        )
+        missing = [author for author_id, author in new_authors.items() if author_id not in self.authors]
+        if not missing:
+            return
+
+        orgs = [org for author in missing for org in author.orgs if org.name not in self.orgs]
+        if orgs:
+            org_table = models.Org.__table__
+            # имя организации не уникально, поэтому без upsert: берем первую найденную
+            for name, org_id in self.db.execute(
+                select(org_table.c.name, org_table.c.id).where(org_table.c.name.in_({org.name for org in orgs}))
+            ):
+                self.orgs.setdefault(name, org_id)
+            new_orgs = {org.name: org.id for org in orgs if org.name not in self.orgs}
+            if new_orgs:
+                self.db.execute(org_table.insert(), [{"id": i, "name": name} for name, i in new_orgs.items()])
+                self.orgs.update(new_orgs)
+
+        crud.insert_ignore_conflicts(
+            self.db, table, [{"id": author.id, "name": author.name} for author in missing], ["id"]
+        )
+        links = {
+            (self.orgs[org.name], author.id) for author in missing for org in author.orgs
+        }
+        if links:
+            self.db.execute(
+                models.org_author.insert(),
+                [{"org_author_id": uuid4(), "org_id": org_id, "author_id": author_id} for org_id, author_id in links],
+            )
+        self.authors.update(author.id for author in missing)
+
+    def insert_links(self, table, id_column: str, entity_column: str, texts: List[schemas.TextBulkInput], entity_ids):
+        rows = [
+            {id_column: uuid4(), "text_id": text.id, entity_column: entity_id}
+            for text in texts
+            for entity_id in dict.fromkeys(entity_ids(text))
+        ]
+        if rows:
+            self.db.execute(table.insert(), rows)
+
+    def insert_citations(self, texts: List[Tuple[schemas.BulkRecordStatus, schemas.TextBulkInput]]):
+        references = {ref for _, text in texts for ref in text.references}
+        if not references:
+            return
+        known = self.existing_texts(references)
+        rows = []
+        for record_status, text in texts:
+            refs = [ref for ref in dict.fromkeys(text.references) if ref != text.id]
+            cited = [ref for ref in refs if ref in known]
+            if len(cited) < len(refs):
+                record_status.detail = f"{len(refs) - len(cited)} references to unknown texts skipped"
+            rows += [{"citation_id": uuid4(), "text_id_from": text.id, "text_id_to": ref} for ref in cited]
+        if not rows:
+            return
+        self.db.execute(models.Citation.__table__.insert(), rows)
+
+        text = models.Text.__table__
+        counts = Counter(row["text_id_to"] for row in rows)
+        self.db.execute(
+            text.update()
+            .where(text.c.id == bindparam("cited_id"))
+            .values(n_citation=text.c.n_citation + bindparam("count")),
+            [{"cited_id": cited_id, "count": count} for cited_id, count in counts.items()],
+        )
+
+    def result(self, seconds: float) -> schemas.BulkIngestResult:
+        counts = Counter(record.status for record in self.records)
+        return schemas.BulkIngestResult(
+            received=len(self.records),
+            created=counts["created"],
+            skipped=counts["exists"] + counts["invalid"],
+            failed=counts["failed"],
+            seconds=seconds,
+            texts_per_second=counts["created"] / seconds if seconds > 0 else 0.,
+            records=self.records,
+        )
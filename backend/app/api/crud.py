@@ -1,16 +1,17 @@
 from collections import Counter
 import logging
 import pandas as pd
-from typing import List
+from typing import Dict, List, Optional
 from uuid import UUID, uuid1
 from datetime import date
 import requests
 from app.api import models, schemas
+from app.api import fuzzy as fuzzy_search
 from fastapi import HTTPException, status
 from passlib import context
-from sqlalchemy.orm import Session
-from app.core.config import SCHEMA_NAME, LOGS_DIR, LOGS_MESSAGE_FORMAT
-from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+from app.core.config import SCHEMA_NAME, LOGS_DIR, LOGS_MESSAGE_FORMAT, CLASSIFICATION_URL, FUZZY_SIMILARITY_THRESHOLD
+from sqlalchemy import case, or_, select
 
 logging.basicConfig(
     filename=LOGS_DIR, level=logging.DEBUG, format=LOGS_MESSAGE_FORMAT, filemode="a+"
@@ -159,88 +160,95 @@ def change_password(db: Session, User_id: UUID, new_password: str):
     return user
 
 
-def get_or_create_orgs(db: Session, orgs: List[schemas.Org]):
-    logging.info(f"{__name__} called")
-    new_orgs = []
-
-    for org in orgs:
-        existing_author = (
-            db.query(models.Org).filter(models.Org.name == org.name).first()
+def insert_ignore_conflicts(db: Session, table, rows: List[dict], index_elements: List[str]):
+    """
+    Bulk insert which skips rows conflicting with existing ones, e.g. inserted by a concurrent request
+    """
+    if db.bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    db.execute(insert(table).values(rows).on_conflict_do_nothing(index_elements=index_elements))
+
+
+def get_or_create_by_names(db: Session, model, names: Dict[str, UUID]) -> list:
+    """
+    Resolves entities with a unique name column with at most three queries for the whole list
+    @names: name -> id for a new row, in the order of the result
+    """
+    if not names:
+        return []
+    found = {
+        row.name: row for row in db.query(model).filter(model.name.in_(list(names))).all()
+    }
+    missing = [name for name in names if name not in found]
+    if missing:
+        insert_ignore_conflicts(
+            db, model.__table__, [{"id": names[name], "name": name} for name in missing], ["name"]
         )
+        for row in db.query(model).filter(model.name.in_(missing)).all():
+            found[row.name] = row
 
-        if existing_author is None:
-            new_orgs.append(models.Org(id=org.id, name=org.name))
-        else:
-            new_orgs.append(existing_author)
+    return [found[name] for name in names]
 
-    return new_orgs
 
-
-def get_or_create_authors(db: Session, authors: List[schemas.Author]):
+def get_or_create_orgs(db: Session, orgs: List[schemas.Org]):
     logging.info(f"{__name__} called")
-    new_authors = []
+    # имя организации не уникально в таблице, поэтому берем первую найденную
+    names = {org.name: org.id for org in orgs}
+    found = {}
+    if names:
+        for org in db.query(models.Org).filter(models.Org.name.in_(list(names))).all():
+            found.setdefault(org.name, org)
 
-    for author in authors:
-        existing_author = (
-            db.query(models.Author).filter(models.Author.id == author.id).first()
-        )
+    return [found.get(name) or models.Org(id=org_id, name=name) for name, org_id in names.items()]
 
-        if existing_author is None:
-            new_author = models.Author(
-                id=author.id, name=author.name, orgs=get_or_create_orgs(db, author.orgs)
-            )
 
-            new_authors.append(new_author)
-        else:
-            new_authors.append(existing_author)
+def get_or_create_authors(db: Session, authors: List[schemas.Author]):
+    logging.info(f"{__name__} called")
+    authors = list({author.id: author for author in authors}.values())
+    if not authors:
+        return []
+    found = {
+        author.id: author
+        for author in db.query(models.Author)
+        .filter(models.Author.id.in_([author.id for author in authors]))
+        .all()
+    }
+
+    missing = [author for author in authors if author.id not in found]
+    # организации всех новых авторов находим одним запросом
+    orgs = {
+        org.name: org
+        for org in get_or_create_orgs(db, [org for author in missing for org in author.orgs])
+    }
+    for author in missing:
+        found[author.id] = models.Author(
+            id=author.id,
+            name=author.name,
+            orgs=list({org.name: orgs[org.name] for org in author.orgs}.values()),
+        )
 
-    return new_authors
+    return [found[author.id] for author in authors]
 
 
 def get_or_create_keywords(db: Session, keywords: List[schemas.Keyword]):
     logging.info(f"{__name__} called")
-    new_keywords = []
-
-    for keyword in keywords:
-        existing_keyword = (
-            db.query(models.Keyword).filter(models.Keyword.name == keyword.name).first()
-        )
-
-        if existing_keyword is None:
-            new_keywords.append(models.Keyword(id=keyword.id, name=keyword.name))
-        else:
-            new_keywords.append(existing_keyword)
-
-    return new_keywords
+    return get_or_create_by_names(
+        db, models.Keyword, {keyword.name: keyword.id for keyword in keywords}
+    )
 
 
 def get_or_create_fos(db: Session, fos_list: List[schemas.Fos]):
     logging.info(f"{__name__} called")
-    new_fos = []
-
-    for fos in fos_list:
-        existing_fos = db.query(models.Fos).filter(models.Fos.name == fos.name).first()
-
-        if existing_fos is None:
-            new_fos.append(models.Fos(id=fos.id, name=fos.name))
-        else:
-            new_fos.append(existing_fos)
-
-    return new_fos
+    return get_or_create_by_names(
+        db, models.Fos, {fos.name: fos.id for fos in fos_list}
+    )
 
 
 def get_or_create_tags(db: Session, tags_list: List[str]):
-    new_tags = []
-
-    for tag in tags_list:
-        existing_tag = db.query(models.Tags).filter(models.Tags.name == tag).first()
-
-        if existing_tag is None:
-            new_tags.append(models.Tags(id=uuid1(), name=tag))
-        else:
-            new_tags.append(existing_tag)
-
-    return new_tags
+    logging.info(f"{__name__} called")
+    return get_or_create_by_names(db, models.Tags, {tag: uuid1() for tag in tags_list})
 
 
 def get_text(db: Session, text_id: UUID):
@@ -392,37 +400,68 @@ def create_citation(db: Session, citation: schemas.Citation):
     return new_citation
 
 
-def get_search(
-    db: Session, tag: str = "", author: str = "", venue_name: str = "", year:str = ""
+def search_texts(
+    db: Session,
+    tag: str = "",
+    author: str = "",
+    venue_name: str = "",
+    year: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 20,
+    fuzzy: bool = False,
+    threshold: float = FUZZY_SIMILARITY_THRESHOLD,
 ):
-    ans_list = []
-
-    def search_filter(answers, params):
-        ans = db.query(models.Text).filter(params).all()
-        for item in ans:
-            answers.append(item)
-        return answers
-
-    if tag == "":
-        tag = "<!?*>"
-    if author == "":
-        author = "<!?*>"
-    if venue_name == "":
-        venue_name = "<!?*>"
-
-    search_filter(ans_list, models.Text.authors.any(name=author))
-    search_filter(ans_list, models.Text.venue_name.contains(venue_name))
-    search_filter(ans_list, models.Text.year==year)
-    if ans_list == []:
-        search_filter(ans_list, models.Text.tags.any(name=tag))
-
-    result = list(Counter(ans_list).keys())[:20]
-    return result
+    """
+    Texts matching any of the given criteria, texts matching more criteria go first.
+    Empty strings and negative year mean that the criterion is not given
+    @fuzzy: author and venue_name may be a part of the name with typos, matched with pg_trgm word similarity
+    """
+    logging.info(f"{__name__} called")
+    criteria = []
+    if fuzzy and (author or venue_name):
+        fuzzy_search.set_threshold(db, threshold)
+    if author:
+        criteria.append(
+            models.Text.authors.any(
+                fuzzy_search.word_match(db, models.Author.name, author)
+                if fuzzy
+                else models.Author.name == author
+            )
+        )
+    if venue_name:
+        criteria.append(
+            fuzzy_search.word_match(db, models.Text.venue_name, venue_name)
+            if fuzzy
+            else models.Text.venue_name.contains(venue_name)
+        )
+    if year is not None and year >= 0:
+        criteria.append(models.Text.year == year)
+    if tag:
+        criteria.append(models.Text.tags.any(models.Tags.name == tag))
+    if not criteria:
+        return []
+
+    score = sum(case((criterion, 1), else_=0) for criterion in criteria)
+    return (
+        db.query(models.Text)
+        .filter(or_(*criteria))
+        .order_by(score.desc(), models.Text.n_citation.desc().nullslast(), models.Text.id)
+        .offset(skip)
+        .limit(limit)
+        # связи нужны для SearchResults, загружаем их одним запросом на связь, а не на каждый текст
+        .options(
+            selectinload(models.Text.keywords),
+            selectinload(models.Text.authors),
+            selectinload(models.Text.tags),
+            selectinload(models.Text.fos),
+        )
+        .all()
+    )
 
 
 def add_text(db: Session, text: schemas.TextInput):
     tags = requests.post(
-        url="http://classification_inference:8088/predict_tags/",
+        url=f"{CLASSIFICATION_URL}/predict_tags/",
         json={"title": text.title, "abstract": text.abstract},
     ).json()["predictions"]
 
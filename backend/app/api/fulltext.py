@@ -0,0 +1,198 @@
+"""
+Full-text search over title and abstract of texts.
+
+On PostgreSQL the text table gets a generated tsvector column (title has weight A, abstract - B)
+with a GIN index, hits are ranked with ts_rank_cd and snippets are made with ts_headline for the
+returned page only. Other databases (SQLite in tests) use an inverted index kept in memory.
+"""
+import re
+import math
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from app.api import models, schemas
+from app.core.config import SCHEMA_NAME
+
+SEARCH_CONFIG = "english"
+HIGHLIGHT_START, HIGHLIGHT_STOP = "<b>", "</b>"
+
+SEARCH_VECTOR_DDL = [
+    f"""
+    ALTER TABLE {SCHEMA_NAME}.text ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(abstract, '')), 'B')
+    ) STORED
+    """,
+    f"CREATE INDEX IF NOT EXISTS text_search_vector_idx ON {SCHEMA_NAME}.text USING GIN (search_vector)",
+]
+
+# ts_headline разбирает весь текст заново, поэтому считаем его только для строк страницы
+SEARCH_QUERY = f"""
+SELECT page.id, page.title, page.year, page.venue_name, page.rank,
+       ts_headline('{SEARCH_CONFIG}', coalesce(page.abstract, page.title, ''), page.q,
+                   'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2, MaxWords=30, MinWords=10')
+           AS snippet
+FROM (
+    SELECT t.id, t.title, t.year, t.venue_name, t.abstract, q,
+           ts_rank_cd(t.search_vector, q) AS rank
+    FROM {SCHEMA_NAME}.text t, websearch_to_tsquery('{SEARCH_CONFIG}', :query) q
+    WHERE t.search_vector @@ q
+    ORDER BY rank DESC, t.id
+    OFFSET :skip
+    LIMIT :limit
+) page
+ORDER BY page.rank DESC, page.id
+"""
+
+
+def create_search_index(engine):
+    """
+    Adds the tsvector column and its index to an existing table, does nothing for other databases.
+    The first run on a full table rewrites it, later runs only check that the column exists
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        for statement in SEARCH_VECTOR_DDL:
+            connection.execute(text(statement))
+    logging.info("full-text search index is ready")
+
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the to was were which with".split()
+)
+TITLE_WEIGHT = 2.
+
+
+def tokenize(value: str) -> List[str]:
+    return [token for token in TOKEN.findall(value.lower()) if token not in STOP_WORDS]
+
+
+class InvertedIndex:
+    """
+    In-memory index of titles and abstracts, hits are ranked with BM25
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[UUID, float]] = defaultdict(dict)
+        self.lengths: Dict[UUID, float] = {}
+        self.documents: Dict[UUID, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, text_id: UUID, title: str, year: int, venue_name: str, abstract: str):
+        if text_id in self.documents:
+            self.remove(text_id)
+        frequencies = Counter()
+        for token in tokenize(title or ""):
+            frequencies[token] += TITLE_WEIGHT
+        frequencies.update(tokenize(abstract or ""))
+        for token, frequency in frequencies.items():
+            self.postings[token][text_id] = frequency
+        self.lengths[text_id] = sum(frequencies.values())
+        self.documents[text_id] = (title, year, venue_name, abstract)
+
+    def remove(self, text_id: UUID):
+        title, _, _, abstract = self.documents.pop(text_id)
+        for token in set(tokenize(title or "")) | set(tokenize(abstract or "")):
+            self.postings[token].pop(text_id, None)
+        del self.lengths[text_id]
+
+    def search(self, query: str, skip: int = 0, limit: int = 20) -> List[Tuple[UUID, float]]:
+        """
+        return: (id, score) of texts which contain all words of the query
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.documents:
+            return []
+        postings = sorted((self.postings.get(term, {}) for term in terms), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting.keys()
+
+        n = len(self.documents)
+        mean_length = sum(self.lengths.values()) / n
+        scores = Counter()
+        for posting in postings:
+            idf = math.log(1 + (n - len(posting) + .5) / (len(posting) + .5))
+            for text_id in candidates:
+                frequency = posting[text_id]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[text_id] / mean_length)
+                scores[text_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], str(item[0])))
+        return ranked[skip:skip + limit]
+
+    def snippet(self, text_id: UUID, query: str, max_words: int = 30) -> str:
+        title, _, _, abstract = self.documents[text_id]
+        terms = set(tokenize(query))
+
+        def matches(word: str) -> bool:
+            return any(token in terms for token in tokenize(word))
+
+        words = (abstract or "").split()
+        first = next((i for i, word in enumerate(words) if matches(word)), None)
+        if first is None:
+            # совпадения только в заголовке
+            words, first = (title or "").split(), 0
+        start = max(0, first - max_words // 3)
+        return " ".join(
+            f"{HIGHLIGHT_START}{word}{HIGHLIGHT_STOP}" if matches(word) else word
+            for word in words[start:start + max_words]
+        )
+
+
+_fallback_index = InvertedIndex()
+_fallback_size = -1
+_fallback_lock = threading.Lock()
+
+
+def fallback_index(db: Session) -> InvertedIndex:
+    """
+    Index of all texts, rebuilt when the number of texts changes
+    """
+    global _fallback_index, _fallback_size
+    size = db.execute(select(func.count()).select_from(models.Text)).scalar()
+    with _fallback_lock:
+        if size != _fallback_size:
+            index = InvertedIndex()
+            for row in db.execute(
+                select(models.Text.id, models.Text.title, models.Text.year, models.Text.venue_name, models.Text.abstract)
+            ):
+                index.add(*row)
+            _fallback_index, _fallback_size = index, size
+        return _fallback_index
+
+
+def search(db: Session, query: str, skip: int = 0, limit: int = 20) -> List[schemas.FullTextHit]:
+    """
+    return: texts which match the query, the most relevant first, with highlighted snippets
+    """
+    logging.info(f"{__name__} called")
+    if not query.strip():
+        return []
+    if db.bind.dialect.name == "postgresql":
+        rows = db.execute(text(SEARCH_QUERY), {"query": query, "skip": skip, "limit": limit})
+        return [schemas.FullTextHit(**row) for row in rows.mappings()]
+
+    index = fallback_index(db)
+    hits = []
+    for text_id, score in index.search(query, skip, limit):
+        title, year, venue_name, _ = index.documents[text_id]
+        hits.append(
+            schemas.FullTextHit(
+                id=text_id, title=title, year=year, venue_name=venue_name, rank=score,
+                snippet=index.snippet(text_id, query),
+            )
+        )
+    return hits
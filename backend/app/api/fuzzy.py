@@ -0,0 +1,127 @@
+"""
+Fuzzy lookup of author names and venues.
+
+On PostgreSQL pg_trgm GIN indexes on author.name and text.venue_name serve the word similarity
+operator (query <% name): the query may be a part of the name and may have typos.
+Prefixes shorter than a trigram are looked up with a B-tree index on lower(name).
+Other databases (SQLite in tests) fall back to substring matching ranked in Python.
+"""
+import logging
+from typing import List
+
+from sqlalchemy import func, literal, select, text
+from sqlalchemy.orm import Session
+
+from app.api import models, schemas
+from app.core.config import FUZZY_SIMILARITY_THRESHOLD, SCHEMA_NAME
+
+MIN_TRIGRAM_LENGTH = 3
+
+TRIGRAM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS author_name_trgm_idx ON {SCHEMA_NAME}.author USING GIN (name gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS text_venue_name_trgm_idx ON {SCHEMA_NAME}.text USING GIN (venue_name gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS author_name_prefix_idx ON {SCHEMA_NAME}.author (lower(name) text_pattern_ops)",
+]
+
+
+def create_trigram_indexes(engine):
+    """
+    Does nothing for other databases, the first run on a full table takes a while
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        for statement in TRIGRAM_DDL:
+            connection.execute(text(statement))
+    logging.info("trigram indexes are ready")
+
+
+def is_postgres(db: Session) -> bool:
+    return db.bind.dialect.name == "postgresql"
+
+
+def set_threshold(db: Session, threshold: float):
+    """
+    Threshold of the <% operator for the current transaction
+    """
+    if is_postgres(db):
+        db.execute(select(func.set_config("pg_trgm.word_similarity_threshold", str(threshold), True)))
+
+
+def word_match(db: Session, column, value: str):
+    """
+    return: condition that value is similar to a part of column
+    """
+    if is_postgres(db):
+        return literal(value).op("<%")(column)
+    return func.lower(column).contains(value.lower())
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def trigrams(value: str) -> set:
+    # как в pg_trgm: каждое слово дополняется двумя пробелами слева и одним справа
+    result = set()
+    for word in value.lower().split():
+        word = f"  {word} "
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def similarity(query: str, name: str) -> float:
+    query_trigrams = trigrams(query)
+    if not query_trigrams:
+        return 0.
+    return len(query_trigrams & trigrams(name)) / len(query_trigrams)
+
+
+def author_candidates(
+    db: Session, query: str, limit: int = 10, threshold: float = FUZZY_SIMILARITY_THRESHOLD
+) -> List[schemas.AuthorCandidate]:
+    """
+    return: authors for the typeahead, the most similar names first
+    """
+    logging.info(f"{__name__} called")
+    query = " ".join(query.split())
+    if not query:
+        return []
+    author = models.Author.__table__
+
+    if len(query) < MIN_TRIGRAM_LENGTH:
+        # в порядке индекса по lower(name), чтобы LIMIT не сортировал все имена на эти буквы
+        lower_name = func.lower(author.c.name)
+        rows = db.execute(
+            select(author.c.id, author.c.name)
+            .where(lower_name.like(f"{escape_like(query.lower())}%", escape="\\"))
+            .order_by(lower_name)
+            .limit(limit)
+        ).all()
+        return [
+            schemas.AuthorCandidate(id=row.id, name=row.name, similarity=similarity(query, row.name))
+            for row in rows
+        ]
+
+    if not is_postgres(db):
+        rows = db.execute(
+            select(author.c.id, author.c.name)
+            .where(func.lower(author.c.name).contains(query.lower(), autoescape=True))
+        ).all()
+        candidates = [
+            schemas.AuthorCandidate(id=row.id, name=row.name, similarity=similarity(query, row.name))
+            for row in rows
+        ]
+        candidates.sort(key=lambda candidate: (-candidate.similarity, candidate.name))
+        return candidates[:limit]
+
+    set_threshold(db, threshold)
+    score = func.word_similarity(query, author.c.name).label("similarity")
+    rows = db.execute(
+        select(author.c.id, author.c.name, score)
+        .where(literal(query).op("<%")(author.c.name))
+        .order_by(score.desc(), author.c.name)
+        .limit(limit)
+    ).all()
+    return [schemas.AuthorCandidate(id=row.id, name=row.name, similarity=row.similarity) for row in rows]
@@ -1,18 +1,21 @@
 import logging
 import sys
+import time
 from typing import List, Optional
 from datetime import datetime
 from uuid import UUID, uuid1
 import pandas as pd
 
 from app.api.graph_visualization import graph_model
-from app.api import crud, models, schemas
+from app.api import bulk_ingest, crud, fulltext, models, schemas
+from app.api import fuzzy as fuzzy_search
 from app.api.database import SessionLocal, engine
-from app.core.config import SCHEMA_NAME, LOGS_DIR, LOGS_MESSAGE_FORMAT
+from app.core.config import SCHEMA_NAME, LOGS_DIR, LOGS_MESSAGE_FORMAT, BULK_CHUNK_SIZE, FUZZY_SIMILARITY_THRESHOLD
 from fastapi import FastAPI, HTTPException, Request, status, Response, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.schema import CreateSchema
 from pydantic import BaseModel, Field
 
@@ -46,6 +49,8 @@ async def startup_event():
     if not engine.dialect.has_schema(engine, SCHEMA_NAME):
         engine.execute(CreateSchema(SCHEMA_NAME))
     models.Base.metadata.create_all(bind=engine)
+    fulltext.create_search_index(engine)
+    fuzzy_search.create_trigram_indexes(engine)
     logging.info(f" table names are {engine.table_names()}")
 
 
@@ -149,6 +154,17 @@ def change_password(request: Request, User_id: UUID, new_password: str):
         return schemas.User.from_orm(crud.change_password(db, User_id, new_password))
 
 
+@app.get(
+    "/authors/typeahead/",
+    response_model=List[schemas.AuthorCandidate],
+    status_code=status.HTTP_200_OK,
+)
+def authors_typeahead(query: str, limit: int = 10, threshold: float = FUZZY_SIMILARITY_THRESHOLD):
+    logging.info(f"{__name__} called")
+    with SessionManager() as db:
+        return fuzzy_search.author_candidates(db, query, min(limit, 50), threshold)
+
+
 @app.get("/author/", response_model=schemas.Author, status_code=status.HTTP_200_OK)
 def get_author(author_id: UUID):
     logging.info(f"{__name__} called")
@@ -285,6 +301,9 @@ def search_request(
     author: str = "",
     venue_name: str = "",
     year: str = "",
+    skip: int = 0,
+    limit: int = 20,
+    fuzzy: bool = False,
 ):
     logging.info(f"{__name__} called")
     try:
@@ -297,7 +316,7 @@ def search_request(
         crud.create_stored_search(db, current_user_id, tag, author, venue_name, year)
         texts = [
             schemas.SearchResults.from_orm(request)
-            for request in crud.get_search(db, tag, author, venue_name, year)
+            for request in crud.search_texts(db, tag, author, venue_name, year, skip, limit, fuzzy)
         ]
         if texts != []:
             return templates.TemplateResponse(
@@ -307,12 +326,52 @@ def search_request(
             return RedirectResponse("/texts/")
 
 
+@app.get(
+    "/search/fulltext/",
+    response_model=List[schemas.FullTextHit],
+    status_code=status.HTTP_200_OK,
+)
+def search_fulltext(query: str, skip: int = 0, limit: int = 20):
+    """
+    Search over titles and abstracts, on PostgreSQL the query supports "quoted phrases", or and -excluded words
+    """
+    logging.info(f"{__name__} called")
+    with SessionManager() as db:
+        return fulltext.search(db, query, skip, limit)
+
+
 @app.post("/text/", response_model=schemas.Text, status_code=status.HTTP_201_CREATED)
 def create_text(text: schemas.TextBase):
     with SessionManager() as db:
         return schemas.Text.from_orm(crud.create_text(db, text))
 
 
+@app.post(
+    "/texts/bulk",
+    response_model=schemas.BulkIngestResult,
+    status_code=status.HTTP_200_OK,
+)
+async def create_texts_bulk(request: Request):
+    """
+    Loads a JSON array or an NDJSON stream (Content-Type: application/x-ndjson) of texts
+    with optional "references" - ids of cited texts
+    return: status of every record
+    """
+    logging.info(f"{__name__} called")
+    started = time.perf_counter()
+    with SessionManager() as db:
+        ingest = bulk_ingest.BulkIngest(db)
+        chunk = []
+        async for record in bulk_ingest.read_records(request):
+            chunk.append(record)
+            if len(chunk) == BULK_CHUNK_SIZE:
+                await run_in_threadpool(ingest.ingest, chunk)
+                chunk = []
+        if chunk:
+            await run_in_threadpool(ingest.ingest, chunk)
+    return ingest.result(time.perf_counter() - started)
+
+
 @app.get("/text/add", status_code=status.HTTP_200_OK)
 def add_text_page(request: Request):
     logging.info(f"{__name__} called")
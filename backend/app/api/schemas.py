@@ -164,3 +164,40 @@ class ArticlesRated(BaseModel):
 
     class Config:
         orm_nodel = True
+
+
+class TextBulkInput(TextInput):
+    # id текстов, которые цитирует этот текст
+    references: List[UUID] = []
+
+
+class BulkRecordStatus(BaseModel):
+    index: int
+    id: Optional[UUID]
+    status: Literal["created", "exists", "invalid", "failed"]
+    detail: str = ""
+
+
+class BulkIngestResult(BaseModel):
+    received: int
+    created: int
+    skipped: int
+    failed: int
+    seconds: float
+    texts_per_second: float
+    records: List[BulkRecordStatus]
+
+
+class FullTextHit(BaseModel):
+    id: UUID
+    title: str
+    year: Optional[int]
+    venue_name: Optional[str]
+    rank: float
+    snippet: str
+
+
+class AuthorCandidate(BaseModel):
+    id: UUID
+    name: str
+    similarity: float
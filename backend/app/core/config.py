@@ -22,4 +22,8 @@ LOGS_DIR = config("LOGS_DIR", cast= str, default = "app/api/logs/log.txt")
 LOGS_MESSAGE_FORMAT = config("LOGS__MESSAGE_FORMAT", cast=str, default="%(asctime)s %(message)s")
 
 
-THREADS_LIMIT = config("THREADS_LIMIT", cast=int, default=5)
\ No newline at end of file
+THREADS_LIMIT = config("THREADS_LIMIT", cast=int, default=5)
+
+CLASSIFICATION_URL = config("CLASSIFICATION_URL", cast=str, default="http://classification_inference:8088")
+BULK_CHUNK_SIZE = config("BULK_CHUNK_SIZE", cast=int, default=1000)
+FUZZY_SIMILARITY_THRESHOLD = config("FUZZY_SIMILARITY_THRESHOLD", cast=float, default=0.5)
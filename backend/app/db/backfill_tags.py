@@ -0,0 +1,196 @@
+"""
+Tags texts which have no tags yet, for example texts added through POST /text/:
+    python -m app.db.backfill_tags --batch-size 64 --rate 4 --checkpoint backfill_tags.json
+
+Untagged texts are streamed in the order of id with a server-side cursor. Every batch is sent to
+/predict_tags_batch of classification_inference and its tags are written with bulk inserts.
+Up to THREADS_LIMIT batches run at the same time and no more than --rate batches per second are started,
+so the classifier keeps serving interactive requests.
+The id of the last text, before which all batches are done, is saved to the checkpoint file.
+A restarted job continues after it.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+from uuid import uuid1
+
+import requests
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from app.api import models
+from app.core.config import CLASSIFICATION_URL, DATABASE_URL, LOGS_DIR, LOGS_MESSAGE_FORMAT, SCHEMA_NAME, THREADS_LIMIT
+
+logging.basicConfig(
+    filename=LOGS_DIR, level=logging.DEBUG, format=LOGS_MESSAGE_FORMAT, filemode="a+"
+)
+
+UNTAGGED_QUERY = f"""
+SELECT t.id, t.title, t.abstract
+FROM {SCHEMA_NAME}.text t
+WHERE NOT EXISTS (SELECT 1 FROM {SCHEMA_NAME}.text_tags tt WHERE tt.text_id = t.id)
+  AND (CAST(:after AS uuid) IS NULL OR t.id > CAST(:after AS uuid))
+ORDER BY t.id
+"""
+
+
+class RateLimiter:
+    """
+    Lets through at most rate calls per second, rate <= 0 disables the limit
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1. / rate if rate > 0 else 0.
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time = max(self.next_time, now) + self.interval
+
+
+class Checkpoint:
+    """
+    Batches finish out of order, so the saved position moves only over the prefix of finished batches
+    @path: json file with the id of the last text of that prefix
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.last_id = None
+        self.tagged = 0
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.last_id, self.tagged = state["last_id"], state["tagged"]
+        self._lock = threading.Lock()
+        self._next = 0
+        self._done: Dict[int, tuple] = {}
+
+    def finished(self, number: int, last_id: str, tagged: int):
+        """
+        @number: sequence number of the batch in the stream, starting from 0
+        """
+        with self._lock:
+            self._done[number] = (last_id, tagged)
+            moved = False
+            while self._next in self._done:
+                self.last_id, batch_tagged = self._done.pop(self._next)
+                self.tagged += batch_tagged
+                self._next += 1
+                moved = True
+            if moved:
+                self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"last_id": self.last_id, "tagged": self.tagged}, f)
+        os.replace(tmp_path, self.path)
+
+
+def predict_tags(session: requests.Session, rows: list) -> List[List[str]]:
+    response = session.post(
+        f"{CLASSIFICATION_URL}/predict_tags_batch",
+        json={"articles": [{"title": row.title or "", "abstract": row.abstract or ""} for row in rows]},
+        timeout=300,
+    )
+    response.raise_for_status()
+    return [prediction["predictions"] for prediction in response.json()["predictions"]]
+
+
+def get_or_create_tag_ids(connection, names: Set[str]) -> Dict[str, object]:
+    """
+    return: ids of tags by name, missing tags are inserted with one statement
+    """
+    tags = models.Tags.__table__
+    connection.execute(
+        insert(tags).values([{"id": uuid1(), "name": name} for name in names]).on_conflict_do_nothing(
+            index_elements=["name"]
+        )
+    )
+    return dict(connection.execute(select(tags.c.name, tags.c.id).where(tags.c.name.in_(names))).all())
+
+
+def write_tags(engine, rows: list, predictions: List[List[str]]) -> int:
+    """
+    return: number of texts which got at least one tag
+    """
+    names = {tag for tags in predictions for tag in tags}
+    if not names:
+        return 0
+    with engine.begin() as connection:
+        tag_ids = get_or_create_tag_ids(connection, names)
+        links = [
+            {"tag_text_id": uuid1(), "tag_id": tag_ids[tag], "text_id": row.id}
+            for row, tags in zip(rows, predictions)
+            for tag in dict.fromkeys(tags)
+        ]
+        connection.execute(models.text_tags.insert(), links)
+    return sum(1 for tags in predictions if tags)
+
+
+def backfill(engine, batch_size: int, concurrency: int, rate: float, checkpoint: Checkpoint,
+             limit: Optional[int] = None):
+    limiter = RateLimiter(rate)
+    # не читаем из курсора больше, чем успеваем обработать
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    local = threading.local()
+    errors = []
+
+    def process(number: int, rows: list):
+        try:
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            tagged = write_tags(engine, rows, predict_tags(local.session, rows))
+            checkpoint.finished(number, str(rows[-1].id), tagged)
+        except Exception as err:
+            errors.append(err)
+            logging.error(f"batch {number} failed: {err!r}")
+        finally:
+            slots.release()
+
+    n_texts = 0
+    with engine.connect() as connection, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        result = connection.execution_options(stream_results=True).execute(
+            text(UNTAGGED_QUERY), {"after": checkpoint.last_id}
+        )
+        for number, rows in enumerate(result.partitions(batch_size)):
+            if errors:
+                break
+            slots.acquire()
+            limiter.wait()
+            pool.submit(process, number, rows)
+            n_texts += len(rows)
+            if number % 10 == 0:
+                logging.info(f"{n_texts} texts sent, checkpoint {checkpoint.last_id}")
+            if limit is not None and n_texts >= limit:
+                break
+    if errors:
+        raise RuntimeError(f"{len(errors)} batches failed, restart continues from {checkpoint.last_id}")
+    logging.info(f"done: {checkpoint.tagged} texts tagged in total, checkpoint {checkpoint.last_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=THREADS_LIMIT)
+    parser.add_argument("--rate", type=float, default=4., help="max batches started per second, 0 - no limit")
+    parser.add_argument("--checkpoint", default="backfill_tags.json")
+    parser.add_argument("--limit", type=int, help="stop after this number of texts")
+    args = parser.parse_args()
+
+    engine = create_engine(DATABASE_URL, pool_size=args.concurrency + 1)
+    backfill(engine, args.batch_size, args.concurrency, args.rate, Checkpoint(args.checkpoint), args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Exports co-author pairs for the co-author index of recsys_inference:
+    python -m app.db.export_coauthors coauthors.tsv
+
+Every line is author_id<TAB>coauthor_id, pairs are written in both directions.
+All pairs come from one self-join of text_author which is streamed with a server-side cursor.
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+from app.core.config import DATABASE_URL, SCHEMA_NAME
+
+BATCH_SIZE = 10000
+
+COAUTHORS_QUERY = f"""
+SELECT DISTINCT a.author_id, b.author_id
+FROM {SCHEMA_NAME}.text_author a
+JOIN {SCHEMA_NAME}.text_author b ON a.text_id = b.text_id AND a.author_id <> b.author_id
+"""
+
+
+def export_coauthors(engine, path: str) -> int:
+    n_pairs = 0
+    with engine.connect() as connection, open(path, "w") as f:
+        result = connection.execution_options(stream_results=True).execute(text(COAUTHORS_QUERY))
+        for rows in result.partitions(BATCH_SIZE):
+            f.writelines(f"{author_id}\t{coauthor_id}\n" for author_id, coauthor_id in rows)
+            n_pairs += len(rows)
+    return n_pairs
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    print(datetime.now(), "exporting co-authors")
+    n_pairs = export_coauthors(create_engine(DATABASE_URL), sys.argv[1])
+    print(datetime.now(), f"{n_pairs} co-author pairs written to {sys.argv[1]}")
@@ -0,0 +1,51 @@
+"""
+Tests run on SQLite: the citation_network schema is an attached in-memory database
+and postgres UUID columns are stored as text. Run from backend directory:
+    python -m pytest tests
+"""
+import os
+import tempfile
+
+# настройки читаются при импорте app.core.config, поэтому задаем их до импорта приложения
+os.environ.setdefault("POSTGRES_USER", "test")
+os.environ.setdefault("POSTGRES_PASSWORD", "test")
+os.environ.setdefault("POSTGRES_DB", "test")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("LOGS_DIR", os.path.join(tempfile.gettempdir(), "citation_network_tests.log"))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app.api import fulltext, models
+from app.core.config import SCHEMA_NAME
+
+
+@compiles(UUID, "sqlite")
+def compile_uuid(type_, compiler, **kw):
+    return "CHAR(36)"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def attach_schema(connection, _):
+        connection.execute(f"ATTACH DATABASE ':memory:' AS {SCHEMA_NAME}")
+
+    models.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    # индекс полнотекстового поиска общий для процесса, а база у каждого теста своя
+    fulltext._fallback_size = -1
+    session = Session(engine)
+    yield session
+    session.close()
@@ -0,0 +1,144 @@
+import json
+import asyncio
+from uuid import UUID, uuid1
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.api import bulk_ingest, models
+
+
+def make_record(title: str, **fields) -> dict:
+    record = {
+        "id": str(uuid1()),
+        "n_citation": 0,
+        "title": title,
+        "year": 2020,
+        "abstract": f"abstract of {title}",
+        "venue_name": "venue",
+        "keywords": [{"name": "graphs"}],
+        "authors": [],
+        "fos": [{"name": "computer science"}],
+    }
+    record.update(fields)
+    return record
+
+
+def make_request(body: bytes, content_type: str, part_size: int = 7) -> Request:
+    parts = [body[start:start + part_size] for start in range(0, len(body), part_size)]
+
+    async def receive():
+        return {"type": "http.request", "body": parts.pop(0) if parts else b"", "more_body": len(parts) > 0}
+
+    return Request({"type": "http", "method": "POST", "headers": [(b"content-type", content_type.encode())]}, receive)
+
+
+def read_all(request: Request) -> list:
+    async def collect():
+        return [record async for record in bulk_ingest.read_records(request)]
+
+    return asyncio.run(collect())
+
+
+def ingest(db, records: list) -> bulk_ingest.BulkIngest:
+    bulk = bulk_ingest.BulkIngest(db)
+    bulk.ingest([(record, "") for record in records])
+    return bulk
+
+
+def test_shared_entities_are_created_once(db):
+    author = {"id": str(uuid1()), "name": "Ada", "orgs": [{"name": "MIPT"}]}
+    records = [make_record(f"text {i}", authors=[author]) for i in range(3)]
+
+    result = ingest(db, records).result(1.)
+
+    assert (result.created, result.skipped, result.failed) == (3, 0, 0)
+    assert db.query(models.Text).count() == 3
+    assert db.query(models.Keyword).count() == 1
+    assert db.query(models.Fos).count() == 1
+    assert db.query(models.Author).count() == 1
+    assert db.query(models.Org).count() == 1
+    assert db.query(models.text_author).count() == 3
+    assert db.query(models.org_author).count() == 1
+
+
+def test_entities_of_earlier_requests_are_reused(db):
+    ingest(db, [make_record("first")])
+    ingest(db, [make_record("second", keywords=[{"name": "graphs"}, {"name": "ml"}])])
+
+    assert sorted(keyword.name for keyword in db.query(models.Keyword)) == ["graphs", "ml"]
+    second = db.query(models.Text).filter(models.Text.title == "second").one()
+    assert sorted(keyword.name for keyword in second.keywords) == ["graphs", "ml"]
+
+
+def test_every_record_gets_a_status(db):
+    existing = make_record("existing")
+    ingest(db, [existing])
+    new = make_record("new")
+
+    bulk = bulk_ingest.BulkIngest(db)
+    bulk.ingest([(new, ""), (new, ""), (existing, ""), ({"title": "no fields"}, ""), (None, "Invalid JSON")])
+
+    assert [record.status for record in bulk.records] == ["created", "exists", "exists", "invalid", "invalid"]
+    assert [record.index for record in bulk.records] == [0, 1, 2, 3, 4]
+    assert bulk.records[0].id == UUID(new["id"])
+    assert bulk.records[4].detail == "Invalid JSON"
+    result = bulk.result(2.)
+    assert (result.received, result.created, result.skipped, result.failed) == (5, 1, 4, 0)
+    assert result.texts_per_second == 0.5
+
+
+def test_references_become_citations(db):
+    cited = make_record("cited", n_citation=3)
+    ingest(db, [cited])
+    unknown = str(uuid1())
+    citing = make_record("citing", references=[cited["id"], cited["id"], unknown])
+    in_request = make_record("cites text of the same request", references=[citing["id"]])
+
+    bulk = ingest(db, [citing, in_request])
+
+    assert db.query(models.Citation).count() == 2
+    counts = {text.title: text.n_citation for text in db.query(models.Text)}
+    assert counts == {"cited": 4, "citing": 1, "cites text of the same request": 0}
+    assert bulk.records[0].detail == "1 references to unknown texts skipped"
+
+
+def test_failed_chunk_is_rolled_back(db, monkeypatch):
+    bulk = bulk_ingest.BulkIngest(db)
+    with monkeypatch.context() as patch:
+        patch.setattr(bulk, "insert_citations", lambda texts: 1 / 0)
+        bulk.ingest([(make_record("lost"), "")])
+    retried = make_record("lost")
+    bulk.ingest([(retried, "")])
+
+    assert [record.status for record in bulk.records] == ["failed", "created"]
+    assert "division by zero" in bulk.records[0].detail
+    assert [text.title for text in db.query(models.Text)] == ["lost"]
+    assert db.query(models.Keyword).count() == 1
+
+
+def test_ndjson_is_parsed_across_parts_of_the_body():
+    records = [make_record("first"), make_record("second")]
+    body = b"\n".join(json.dumps(record).encode() for record in records) + b"\n\nnot json"
+
+    parsed = read_all(make_request(body, "application/x-ndjson; charset=utf-8"))
+
+    assert [record for record, _ in parsed[:2]] == records
+    assert parsed[2][0] is None
+    assert parsed[2][1].startswith("Invalid JSON")
+
+
+def test_json_array():
+    records = [make_record("first"), make_record("second")]
+
+    parsed = read_all(make_request(json.dumps(records).encode(), "application/json"))
+
+    assert parsed == [(record, "") for record in records]
+
+
+@pytest.mark.parametrize("body", [b"{\"title\": \"not an array\"}", b"[{"])
+def test_json_body_which_is_not_an_array_is_rejected(body):
+    with pytest.raises(HTTPException) as error:
+        read_all(make_request(body, "application/json"))
+    assert error.value.status_code == 400
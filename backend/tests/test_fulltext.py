@@ -0,0 +1,87 @@
+from uuid import uuid1
+
+from app.api import fulltext, models
+
+
+def add_texts(db, *texts):
+    db.add_all([
+        models.Text(id=uuid1(), title=title, abstract=abstract, year=2020, venue_name="venue")
+        for title, abstract in texts
+    ])
+    db.commit()
+
+
+def test_tokenize_drops_case_punctuation_and_stop_words():
+    assert fulltext.tokenize("The Graph-based Models, of citations!") == ["graph", "based", "models", "citations"]
+
+
+def test_hits_contain_all_words_and_title_matches_rank_higher():
+    index = fulltext.InvertedIndex()
+    in_title, in_abstract, one_word = uuid1(), uuid1(), uuid1()
+    index.add(in_title, "Graph neural networks", 2020, "venue", "We propose a model.")
+    index.add(in_abstract, "A study", 2020, "venue", "We apply graph methods to neural networks.")
+    index.add(one_word, "Graphs", 2020, "venue", "Only graph here.")
+
+    assert [text_id for text_id, _ in index.search("neural graph")] == [in_title, in_abstract]
+    assert index.search("") == []
+    assert index.search("missing") == []
+
+
+def test_readded_text_replaces_its_postings():
+    index = fulltext.InvertedIndex()
+    text_id = uuid1()
+    index.add(text_id, "Old title", 2020, "venue", "")
+    index.add(text_id, "New title", 2020, "venue", "")
+
+    assert len(index) == 1
+    assert index.search("old") == []
+    assert [hit for hit, _ in index.search("new")] == [text_id]
+
+
+def test_pagination():
+    index = fulltext.InvertedIndex()
+    for i in range(5):
+        index.add(uuid1(), f"graph {i}", 2020, "venue", "graph " * i)
+
+    everything = index.search("graph")
+    assert index.search("graph", skip=1, limit=2) == everything[1:3]
+
+
+def test_snippet_highlights_matches_of_the_abstract_or_the_title():
+    index = fulltext.InvertedIndex()
+    in_abstract, in_title = uuid1(), uuid1()
+    index.add(in_abstract, "A study", 2020, "venue", "Long introduction. " * 10 + "We study graph methods.")
+    index.add(in_title, "Graph methods", 2020, "venue", "Nothing related.")
+
+    snippet = index.snippet(in_abstract, "graph", max_words=6)
+    assert "<b>graph</b>" in snippet
+    assert not snippet.startswith("Long")
+    assert index.snippet(in_title, "graph") == "<b>Graph</b> methods"
+
+
+def test_search_falls_back_to_the_inverted_index_on_sqlite(db):
+    add_texts(db, ("Graph neural networks", "Citation recommendation with graphs."), ("Other", "Nothing."))
+
+    hits = fulltext.search(db, "citation recommendation")
+
+    assert [hit.title for hit in hits] == ["Graph neural networks"]
+    assert hits[0].snippet == "<b>Citation</b> <b>recommendation</b> with graphs."
+    assert hits[0].rank > 0
+    assert fulltext.search(db, "   ") == []
+
+
+def test_fallback_index_is_rebuilt_after_new_texts(db):
+    add_texts(db, ("Graph neural networks", ""))
+    assert fulltext.search(db, "transformers") == []
+
+    add_texts(db, ("Transformers for citations", ""))
+
+    assert [hit.title for hit in fulltext.search(db, "transformers")] == ["Transformers for citations"]
+
+
+def test_search_index_is_not_created_on_sqlite(engine):
+    fulltext.create_search_index(engine)
+
+    with engine.connect() as connection:
+        columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA {models.Text.__table__.schema}.table_info(text)")]
+    assert "search_vector" not in columns
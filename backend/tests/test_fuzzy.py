@@ -0,0 +1,68 @@
+from uuid import uuid1
+
+import pytest
+
+from app.api import crud, fuzzy, models
+
+
+@pytest.fixture
+def authors(db):
+    names = ["Geoffrey Hinton", "Geoff Hintonn", "Yann LeCun", "Andrew Ng", "An_drew 100%", "Yoshua Bengio"]
+    db.execute(models.Author.__table__.insert(), [{"id": uuid1(), "name": name} for name in names])
+    db.commit()
+
+
+def names(candidates) -> list:
+    return [candidate.name for candidate in candidates]
+
+
+def test_trigrams_are_padded_like_pg_trgm():
+    assert fuzzy.trigrams("Cat") == {"  c", " ca", "cat", "at "}
+    assert fuzzy.similarity("hinton", "Geoffrey Hinton") == 1.
+    assert 0 < fuzzy.similarity("hinton", "Geoff Hintonn") < 1
+    assert fuzzy.similarity("", "Hinton") == 0.
+
+
+def test_typeahead_ranks_by_similarity(db, authors):
+    candidates = fuzzy.author_candidates(db, "  hinton ")
+
+    assert names(candidates) == ["Geoffrey Hinton", "Geoff Hintonn"]
+    assert candidates[0].similarity > candidates[1].similarity
+
+
+def test_short_prefix_is_matched_from_the_start_of_the_name(db, authors):
+    assert names(fuzzy.author_candidates(db, "an")) == ["An_drew 100%", "Andrew Ng"]
+    assert names(fuzzy.author_candidates(db, "an", limit=1)) == ["An_drew 100%"]
+    assert names(fuzzy.author_candidates(db, "ng")) == []
+
+
+def test_like_wildcards_are_literal(db, authors):
+    assert names(fuzzy.author_candidates(db, "An_")) == ["An_drew 100%"]
+    assert names(fuzzy.author_candidates(db, "100%")) == ["An_drew 100%"]
+    assert fuzzy.author_candidates(db, "%") == []
+
+
+def test_empty_query(db, authors):
+    assert fuzzy.author_candidates(db, "   ") == []
+
+
+def test_fuzzy_search_matches_parts_of_author_and_venue(db):
+    db.add_all([
+        models.Text(title="by hinton", year=2019, venue_name="ICML", authors=[models.Author(name="Geoffrey Hinton")]),
+        models.Text(title="at neurips", year=2019, venue_name="NeurIPS 2019"),
+    ])
+    db.commit()
+
+    assert [text.title for text in crud.search_texts(db, author="hinton", fuzzy=True)] == ["by hinton"]
+    assert crud.search_texts(db, author="hinton") == []
+    assert [text.title for text in crud.search_texts(db, venue_name="neurips", fuzzy=True)] == ["at neurips"]
+
+
+def test_trigram_indexes_are_not_created_on_sqlite(engine):
+    fuzzy.create_trigram_indexes(engine)
+
+    with engine.connect() as connection:
+        indexes = [row[1] for row in connection.exec_driver_sql(
+            f"PRAGMA {models.Author.__table__.schema}.index_list(author)"
+        )]
+    assert not any("trgm" in index for index in indexes)
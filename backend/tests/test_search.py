@@ -0,0 +1,58 @@
+import pytest
+
+from app.api import crud, models
+
+
+@pytest.fixture
+def texts(db):
+    ada = models.Author(name="Ada Lovelace")
+    alan = models.Author(name="Alan Turing")
+    graphs = models.Tags(name="graphs")
+    db.add_all([
+        models.Text(title="all three", year=2015, venue_name="NeurIPS 2015", n_citation=1, authors=[ada], tags=[graphs]),
+        models.Text(title="author and year", year=2015, venue_name="ICML", n_citation=5, authors=[ada]),
+        models.Text(title="year only", year=2015, venue_name="KDD", n_citation=50, authors=[alan]),
+        models.Text(title="venue only", year=2001, venue_name="NeurIPS 2001", n_citation=10, authors=[alan]),
+        models.Text(title="tag only", year=2001, venue_name="KDD", n_citation=0, tags=[graphs]),
+        models.Text(title="nothing", year=2001, venue_name="ICML", n_citation=100),
+    ])
+    db.commit()
+
+
+def titles(results) -> list:
+    return [text.title for text in results]
+
+
+def test_texts_matching_more_criteria_go_first(db, texts):
+    results = crud.search_texts(db, tag="graphs", author="Ada Lovelace", venue_name="NeurIPS", year=2015)
+
+    assert titles(results) == ["all three", "author and year", "year only", "venue only", "tag only"]
+
+
+def test_equal_scores_are_ordered_by_citations(db, texts):
+    assert titles(crud.search_texts(db, year=2015)) == ["year only", "author and year", "all three"]
+
+
+def test_pagination_happens_in_the_query(db, texts):
+    everything = titles(crud.search_texts(db, venue_name="NeurIPS", year=2015))
+
+    pages = [titles(crud.search_texts(db, venue_name="NeurIPS", year=2015, skip=skip, limit=2)) for skip in (0, 2)]
+
+    assert pages == [everything[:2], everything[2:4]]
+
+
+def test_criteria_which_are_not_given_are_ignored(db, texts):
+    assert crud.search_texts(db) == []
+    assert crud.search_texts(db, year=-1) == []
+    assert titles(crud.search_texts(db, author="Alan Turing", year=-1)) == ["year only", "venue only"]
+
+
+def test_author_is_matched_exactly(db, texts):
+    assert crud.search_texts(db, author="Ada") == []
+
+
+def test_relationships_are_loaded(db, texts):
+    result = crud.search_texts(db, tag="graphs")
+
+    assert [[author.name for author in text.authors] for text in result] == [["Ada Lovelace"], []]
+    assert [[tag.name for tag in text.tags] for text in result] == [["graphs"], ["graphs"]]
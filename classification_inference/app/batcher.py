@@ -0,0 +1,117 @@
+import time
+import asyncio
+from collections import Counter, deque
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Groups single requests into batches for a model which is faster on batches.
+    Requests wait in an asyncio queue, a background task takes them while the batch is smaller than
+    max_batch_size and the first request of the batch waits less than max_wait_ms
+    @predict_batch: function of a list of items which returns a list of results in the same order,
+                    it is called in a thread so the event loop keeps accepting requests
+    @max_inflight: max number of batches predicted at the same time
+    """
+
+    def __init__(self, predict_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5., max_inflight: int = 1, history: int = 1000):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_inflight = max_inflight
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.batch_sizes = Counter()
+        self.items = 0
+        # время ожидания в очереди и предсказания для последних запросов и батчей
+        self.wait_ms = deque(maxlen=history)
+        self.predict_ms = deque(maxlen=history)
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def submit(self, item: Any) -> Any:
+        """
+        return: result of predict_batch for this item
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        inflight = asyncio.Semaphore(self.max_inflight)
+        while True:
+            # пока все батчи в работе, новые запросы копятся в очереди и следующий батч получается больше
+            await inflight.acquire()
+            batch = await self._collect()
+            task = asyncio.get_event_loop().create_task(self._predict(batch))
+            task.add_done_callback(lambda _: inflight.release())
+
+    async def _predict(self, batch: list):
+        started = time.perf_counter()
+        self.wait_ms.extend((started - queued) * 1000 for _, _, queued in batch)
+        try:
+            results = await asyncio.get_event_loop().run_in_executor(
+                None, self.predict_batch, [item for item, _, _ in batch]
+            )
+        except Exception as err:
+            results, error = None, err
+        else:
+            error = None
+        self.predict_ms.append((time.perf_counter() - started) * 1000)
+        self.batch_sizes[len(batch)] += 1
+        self.items += len(batch)
+        for i, (_, future, _) in enumerate(batch):
+            # клиент мог отключиться и отменить ожидание
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[i])
+
+    def stats(self) -> dict:
+        batches = sum(self.batch_sizes.values())
+        wait_ms = np.array(self.wait_ms) if self.wait_ms else np.zeros(1)
+        return {
+            "queue_length": self.queue.qsize() if self.queue is not None else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_inflight": self.max_inflight,
+            "batches": batches,
+            "items": self.items,
+            "mean_batch_size": self.items / batches if batches else 0.,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "wait_ms_p50": float(np.percentile(wait_ms, 50)),
+            "wait_ms_p99": float(np.percentile(wait_ms, 99)),
+            "predict_ms_mean": float(np.mean(self.predict_ms)) if self.predict_ms else 0.,
+        }
@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+SQLITE_MAX_PARAMS = 900
+
+
+def normalize_text(text: str) -> str:
+    # регистр не трогаем: модель может его учитывать, а пробелы и переносы на предсказание не влияют
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def content_key(text: str, model_id: str) -> str:
+    """
+    return: key of the text for the model, the same text gets another key after the model changes
+    """
+    return hashlib.sha256(f"{model_id}\0{normalize_text(text)}".encode()).hexdigest()
+
+
+class PredictionCache:
+    """
+    Two tier cache of predicted tags: LRU in memory and optional SQLite file which survives restarts
+    @maxsize: max number of predictions in memory, least recently used are evicted first
+    @path: SQLite file, None disables the persistent tier
+    """
+
+    def __init__(self, maxsize: int, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.path = path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, tags TEXT NOT NULL)")
+            self._db.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key: str, tags: List[str]):
+        self._memory[key] = tags
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get_memory(self, key: str) -> Optional[List[str]]:
+        """
+        Looks up the memory tier only, never touches the disk, so it is safe to call from the event loop
+        """
+        with self._lock:
+            tags = self._memory.get(key)
+            if tags is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return tags
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        return: predictions found in any tier, predictions found on disk are moved to memory
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self.memory_hits += len(found)
+            missing = [key for key in keys if key not in found]
+            # старые сборки SQLite ограничивают запрос 999 параметрами
+            for start in range(0, len(missing) if self._db is not None else 0, SQLITE_MAX_PARAMS):
+                chunk = missing[start:start + SQLITE_MAX_PARAMS]
+                rows = self._db.execute(
+                    f"SELECT key, tags FROM predictions WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, tags in rows:
+                    found[key] = json.loads(tags)
+                    self._remember(key, found[key])
+                self.disk_hits += len(rows)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, predictions: Dict[str, List[str]]):
+        with self._lock:
+            for key, tags in predictions.items():
+                self._remember(key, tags)
+            if self._db is not None and predictions:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO predictions (key, tags) VALUES (?, ?)",
+                    [(key, json.dumps(tags)) for key, tags in predictions.items()],
+                )
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.memory_hits + self.disk_hits + self.misses
+            disk_size = None
+            if self._db is not None:
+                disk_size = self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            return {
+                "memory_size": len(self._memory),
+                "maxsize": self.maxsize,
+                "disk_path": self.path,
+                "disk_size": disk_size,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / requests if requests else 0.,
+                "evictions": self.evictions,
+            }
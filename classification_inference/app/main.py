@@ -1,25 +1,115 @@
+import gc
 import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import dill
-import gdown
 from app import schemas
-from fastapi import FastAPI, status
+from app.batcher import MicroBatcher
+from app.cache import PredictionCache, content_key
+from common.artifacts import artifact_version, fetch
+from fastapi import FastAPI, HTTPException, status
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s\t%(levelname)s\t%(message)s")
+logger = logging.getLogger("logging_service")
 
 app = FastAPI()
+started_at = None
 classifier = None
+model_path = "models/transformer.pkl"
+# версия модели (sha256 из манифеста) входит в ключ кэша, после обновления модели старые предсказания не используются
+model_id = None
+prediction_cache = None
+max_batch_size = int(os.environ.get("MAX_BATCH_SIZE", 256))
+# 0 - модель вызывается в потоках этого процесса, N > 0 - в N форках с общей памятью модели
+classifier_workers = int(os.environ.get("CLASSIFIER_WORKERS", 0))
+max_inflight = int(os.environ.get("CLASSIFIER_MAX_INFLIGHT", max(1, classifier_workers)))
+inflight = threading.BoundedSemaphore(max_inflight)
+pool = None
+
+
+def article_text(article: schemas.Article) -> str:
+    return article.title + " " + article.abstract
+
+
+def classify_local(texts):
+    # у модели есть только predict для одного текста, батч выигрывает на кэше, дедупликации и пуле процессов
+    return [classifier.predict(text) for text in texts]
+
+
+def classify(texts):
+    # не больше max_inflight батчей в модели одновременно, остальные ждут
+    with inflight:
+        if pool is None:
+            return classify_local(texts)
+        return pool.submit(classify_local, texts).result()
+
+
+def start_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Forks workers after the model is loaded, so they share its memory pages copy-on-write
+    """
+    # объекты модели уходят из-под сборщика мусора, иначе он трогает их страницы и они копируются в каждый форк
+    gc.freeze()
+    process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+    # форки создаются при первой задаче, делаем это при старте, а не на первом запросе
+    process_pool.submit(len, []).result()
+    return process_pool
+
+
+def predict_batch(texts):
+    keys = [content_key(text, model_id) for text in texts]
+    found = prediction_cache.get_many(keys)
+    # одинаковые тексты внутри батча классифицируем один раз
+    missing = {key: text for key, text in zip(keys, texts) if key not in found}
+    if missing:
+        predicted = {key: list(tags) for key, tags in zip(missing.keys(), classify(list(missing.values())))}
+        prediction_cache.put_many(predicted)
+        found.update(predicted)
+    return [found[key] for key in keys]
+
+
+batcher = MicroBatcher(
+    predict_batch,
+    max_batch_size=int(os.environ.get("MICRO_BATCH_SIZE", 32)),
+    max_wait_ms=float(os.environ.get("MICRO_BATCH_WAIT_MS", 5)),
+    max_inflight=max_inflight,
+)
 
 
 @app.on_event("startup")
 def startup_event():
-    gdown.download(
-        url=os.environ["MODEL_LINK"],
-        output="models/transformer.pkl",
-        quiet=False,
-        fuzzy=True,
-    )
-    global classifier
-    with open("models/transformer.pkl", "rb") as file:
+    global started_at
+    started_at = time.monotonic()
+    # скачиваем, только если модели нет в локальном кэше или она не совпадает с манифестом
+    fetch(model_path, os.environ.get("MODEL_LINK"))
+    global classifier, model_id, prediction_cache, pool
+    with open(model_path, "rb") as file:
         classifier = dill.load(file)
+    if classifier_workers > 0:
+        pool = start_pool(classifier_workers)
+    model_id = artifact_version(model_path)
+    prediction_cache = PredictionCache(
+        maxsize=int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)),
+        path=os.environ.get("PREDICTION_CACHE_PATH") or None,
+    )
+
+
+@app.on_event("startup")
+async def start_batcher():
+    batcher.start()
+    logger.info(f"Ready in {time.monotonic() - started_at:.1f}s since server start")
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
+    prediction_cache.close()
+    if pool is not None:
+        pool.shutdown()
 
 
 @app.get("/health")
@@ -30,7 +120,35 @@ def health():
 
 
 @app.post("/predict_tags", response_model=schemas.Predictions)
-def predict_tags(article: schemas.Article):
+async def predict_tags(article: schemas.Article):
+    text = article_text(article)
+    cached = prediction_cache.get_memory(content_key(text, model_id))
+    if cached is not None:
+        return schemas.Predictions(predictions=cached)
+    # одиночные запросы копятся в очереди и уходят в модель батчами
     return schemas.Predictions(
-        predictions=classifier.predict(article.title + " " + article.abstract)
+        predictions=await batcher.submit(text)
+    )
+
+
+@app.get("/predict_tags/stats")
+async def predict_tags_stats() -> dict:
+    return batcher.stats()
+
+
+@app.get("/cache/stats")
+def cache_stats() -> dict:
+    return prediction_cache.stats()
+
+
+@app.post("/predict_tags_batch", response_model=schemas.BatchPredictions)
+def predict_tags_batch(batch: schemas.ArticlesBatch):
+    if len(batch.articles) > max_batch_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch size {len(batch.articles)} exceeds MAX_BATCH_SIZE={max_batch_size}",
+        )
+    predictions = predict_batch([article_text(article) for article in batch.articles])
+    return schemas.BatchPredictions(
+        predictions=[schemas.Predictions(predictions=tags) for tags in predictions]
     )
@@ -10,3 +10,11 @@ class Predictions(BaseModel):
 class Article(BaseModel):
     title: str
     abstract: str
+
+
+class ArticlesBatch(BaseModel):
+    articles: List[Article]
+
+
+class BatchPredictions(BaseModel):
+    predictions: List[Predictions]
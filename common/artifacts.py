@@ -0,0 +1,156 @@
+"""
+Local cache of downloaded artifacts (models, embeddings) shared by the inference services.
+
+An artifact is downloaded only if its file is missing. The download goes to a temporary file which is
+renamed into place after its checksum is verified, so a killed download never leaves a broken artifact.
+Expected checksums are read from <artifacts dir>/manifest.json (or ARTIFACT_MANIFEST):
+    {"graph_model.pkl": {"sha256": "...", "size": 123}}
+Artifacts without an entry in the manifest are not verified.
+
+ARTIFACT_OFFLINE=1 forbids downloads: services start only from files which are already in place.
+
+The manifest is written from the files downloaded once:
+    python -m common.artifacts manifest recsys_inference/app/models
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+from typing import Optional
+
+logger = logging.getLogger("logging_service")
+
+MANIFEST_FILE = "manifest.json"
+VERIFIED_SUFFIX = ".verified"
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_offline() -> bool:
+    return os.environ.get("ARTIFACT_OFFLINE", "0").lower() in ("1", "true", "yes")
+
+
+def manifest_path(path: str) -> str:
+    return os.environ.get("ARTIFACT_MANIFEST") or os.path.join(os.path.dirname(path) or ".", MANIFEST_FILE)
+
+
+def read_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def expected_sha256(path: str) -> Optional[str]:
+    entry = read_manifest(manifest_path(path)).get(os.path.basename(path))
+    return None if entry is None else entry["sha256"]
+
+
+def artifact_version(path: str) -> str:
+    """
+    return: id of the artifact content taken without hashing the file: sha256 from the manifest,
+            which fetch has already verified, or size and mtime for artifacts missing from the manifest
+    """
+    sha256 = expected_sha256(path)
+    if sha256 is not None:
+        return sha256
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def verify(path: str, sha256: Optional[str]) -> bool:
+    """
+    return: True if the file has the expected checksum or there is no checksum to compare with.
+            The result is remembered in a sidecar file while size and mtime of the file do not change,
+            so large artifacts are hashed once and not on every start
+    """
+    if sha256 is None:
+        return True
+    stat = os.stat(path)
+    stamp = {"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime}
+    sidecar = path + VERIFIED_SUFFIX
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            if json.load(f) == stamp:
+                return True
+    if file_sha256(path) != sha256:
+        return False
+    with open(sidecar, "w") as f:
+        json.dump(stamp, f)
+    return True
+
+
+def download(url: str, path: str):
+    import gdown
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        if gdown.download(url=url, output=tmp_path, quiet=False, fuzzy=True) is None:
+            raise RuntimeError(f"Download of {url} failed")
+        sha256 = expected_sha256(path)
+        if not verify(tmp_path, sha256):
+            raise RuntimeError(f"Checksum of {url} does not match the manifest")
+        os.replace(tmp_path, path)
+        if sha256 is not None:
+            os.replace(tmp_path + VERIFIED_SUFFIX, path + VERIFIED_SUFFIX)
+    finally:
+        for leftover in (tmp_path, tmp_path + VERIFIED_SUFFIX):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def fetch(path: str, url: Optional[str]) -> str:
+    """
+    @path: local path of the artifact
+    @url: where to download the artifact from if it is missing or broken
+    return: path of the verified artifact
+    """
+    sha256 = expected_sha256(path)
+    if os.path.exists(path):
+        if verify(path, sha256):
+            logger.info(f"Artifact {path} is taken from the local cache")
+            return path
+        logger.info(f"Artifact {path} does not match the manifest")
+        if is_offline():
+            raise RuntimeError(f"Artifact {path} is broken and ARTIFACT_OFFLINE forbids downloading it again")
+    elif is_offline():
+        raise RuntimeError(f"Artifact {path} is missing and ARTIFACT_OFFLINE forbids downloads")
+    if url is None:
+        raise RuntimeError(f"Artifact {path} is missing and has no url")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    logger.info(f"Downloading {url} to {path}")
+    started = time.monotonic()
+    download(url, path)
+    logger.info(f"Artifact {path} downloaded in {time.monotonic() - started:.1f}s")
+    return path
+
+
+def write_manifest(directory: str, path: Optional[str] = None):
+    """
+    Records checksums of all files of the directory
+    """
+    path = path or os.path.join(directory, MANIFEST_FILE)
+    manifest = {}
+    for name in sorted(os.listdir(directory)):
+        file_path = os.path.join(directory, name)
+        if not os.path.isfile(file_path) or name == MANIFEST_FILE or name.endswith(VERIFIED_SUFFIX):
+            continue
+        manifest[name] = {"sha256": file_sha256(file_path), "size": os.path.getsize(file_path)}
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Manifest of {len(manifest)} artifacts written to {path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != "manifest":
+        print(__doc__)
+        sys.exit(1)
+    write_manifest(*sys.argv[2:])
@@ -0,0 +1,186 @@
+import os
+import logging
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from app.index import EmbeddingIndex, normalize_rows, top_k
+
+logger = logging.getLogger("logging_service")
+
+
+def spherical_kmeans(vectors: ndarray, n_clusters: int, n_iter: int = 10, seed: int = 0,
+                     block_size: int = 65536) -> ndarray:
+    """
+    @vectors: normalized ndarray of shape (n, dim), n >= n_clusters
+    @n_clusters: number of centroids
+    @n_iter: number of Lloyd iterations
+    return: normalized centroids of shape (n_clusters, dim)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = assign(vectors, centroids, block_size)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(vectors[np.argsort(assignments, kind="stable")], starts[~empty], axis=0)
+        # пустые кластеры переинициализируем случайными точками
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def assign(vectors: ndarray, centroids: ndarray, block_size: int = 65536) -> ndarray:
+    """
+    return: index of the closest (by cosine) centroid for every row of vectors
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def layout(rows: ndarray, lists: ndarray, nlist: int) -> Tuple[ndarray, ndarray]:
+    """
+    @rows: rows of the base index
+    @lists: cluster of every row
+    return: (list_rows, list_offsets) with rows sorted by cluster
+    """
+    order = np.argsort(lists, kind="stable")
+    return rows[order], np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=nlist))])
+
+
+class IVFIndex:
+    """
+    Approximate cosine search: rows of the base index are clustered with spherical k-means
+    and a query scans only the rows of nprobe clusters closest to it
+    @base: exact index which holds ids and vectors
+    @centroids: normalized ndarray of shape (nlist, dim)
+    @list_rows: rows of base sorted by cluster
+    @list_offsets: rows of cluster c are list_rows[list_offsets[c]:list_offsets[c + 1]]
+    @nprobe: number of clusters scanned when request does not set it
+    @added_rows: rows upserted after the lists were laid out, with their clusters in added_lists
+    """
+
+    def __init__(self, base: EmbeddingIndex, centroids: ndarray, list_rows: ndarray,
+                 list_offsets: ndarray, nprobe: int = 16, added_rows: Optional[ndarray] = None,
+                 added_lists: Optional[ndarray] = None):
+        self.base = base
+        self.centroids = centroids
+        self.list_rows = list_rows
+        self.list_offsets = list_offsets
+        self.nprobe = nprobe
+        self.added_rows = np.empty(0, dtype=np.int64) if added_rows is None else added_rows
+        self.added_lists = np.empty(0, dtype=np.int64) if added_lists is None else added_lists
+
+    @classmethod
+    def build(cls, base: EmbeddingIndex, nlist: int, nprobe: int = 16, n_iter: int = 10,
+              train_size: int = 256, seed: int = 0) -> "IVFIndex":
+        """
+        @nlist: number of clusters
+        @train_size: number of training points per cluster used by k-means
+        """
+        nlist = min(nlist, len(base))
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(base), min(len(base), nlist * train_size), replace=False)
+        centroids = spherical_kmeans(base.vectors[np.sort(sample)], nlist, n_iter, seed)
+        assignments = assign(base.vectors, centroids)
+        return cls(base, centroids, *layout(np.arange(len(base)), assignments, nlist), nprobe)
+
+    def upsert(self, base: EmbeddingIndex, rows: ndarray) -> "IVFIndex":
+        """
+        @base: new snapshot of the base index
+        @rows: rows of base added by upsert, they are assigned to existing centroids without retraining
+        return: new snapshot of the ivf index
+        """
+        added_rows = np.concatenate([self.added_rows, rows])
+        added_lists = np.concatenate([self.added_lists, assign(base.vectors[rows], self.centroids)])
+        if len(added_rows) <= max(1024, len(self.list_rows) // 4):
+            return IVFIndex(base, self.centroids, self.list_rows, self.list_offsets, self.nprobe,
+                            added_rows, added_lists)
+        # добавленных строк накопилось много, раскладываем их по спискам заново
+        lists = np.repeat(np.arange(self.nlist), np.diff(self.list_offsets))
+        list_rows, list_offsets = layout(
+            np.concatenate([self.list_rows, added_rows]), np.concatenate([lists, added_lists]), self.nlist
+        )
+        return IVFIndex(base, self.centroids, list_rows, list_offsets, self.nprobe)
+
+    def save(self, path: str):
+        if len(self.added_rows):
+            lists = np.repeat(np.arange(self.nlist), np.diff(self.list_offsets))
+            list_rows, list_offsets = layout(
+                np.concatenate([self.list_rows, self.added_rows]),
+                np.concatenate([lists, self.added_lists]), self.nlist,
+            )
+        else:
+            list_rows, list_offsets = self.list_rows, self.list_offsets
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids, list_rows=list_rows,
+                     list_offsets=list_offsets, n_rows=len(self.base))
+
+    @classmethod
+    def load(cls, base: EmbeddingIndex, path: str, nprobe: int = 16) -> "IVFIndex":
+        with np.load(path) as data:
+            if int(data["n_rows"]) != len(base):
+                raise ValueError(f"Index {path} was built for {int(data['n_rows'])} rows, got {len(base)}")
+            return cls(base, data["centroids"], data["list_rows"], data["list_offsets"], nprobe)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def candidates(self, query: ndarray, nprobe: int) -> ndarray:
+        """
+        return: rows of base which belong to the nprobe clusters closest to normalized query
+        """
+        probes = top_k(self.centroids @ query, nprobe)
+        return np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes
+        ] + [self.added_rows[np.isin(self.added_lists, probes)]])
+
+    def search(self, query: ndarray, k: int, exclude: Iterable[str] = (), mask: Optional[ndarray] = None,
+               nprobe: Optional[int] = None) -> Tuple[ndarray, ndarray]:
+        """
+        @mask: bool ndarray over rows of base, only rows where it is True may be returned
+        @nprobe: number of clusters to scan, more clusters give better recall and higher latency
+        return: (ids, dist) of approximate k nearest neighbors sorted by cosine distance
+        """
+        query = normalize_rows(query)
+        rows = self.candidates(query, nprobe or self.nprobe)
+        scores = self.base.vectors[rows] @ query
+        scores[np.isin(rows, self.base.excluded_rows(exclude))] = -np.inf
+        if mask is not None:
+            scores[~mask[rows]] = -np.inf
+        best = top_k(scores, k)
+        if len(best) < k and mask is not None:
+            # в просмотренных кластерах не нашлось k статей под фильтр, сканируем все
+            return self.base.search(query, k, exclude, mask)
+        return self.base.ids[rows[best]], 1. - scores[best]
+
+
+def make_search_index(base: EmbeddingIndex, kind: str, path: Optional[str] = None,
+                      nlist: int = 1024, nprobe: int = 16):
+    """
+    @kind: "exact" for brute force search or "ivf" for the inverted file index
+    @path: file of a prebuilt ivf index, the index is built and saved there if the file is missing
+    return: object with search(query, k, exclude, nprobe) method
+    """
+    if kind == "exact":
+        return base
+    if kind != "ivf":
+        raise ValueError(f"Unknown ann index {kind}")
+    if path is not None and os.path.exists(path):
+        logger.info(f"Loading ivf index from {path}")
+        return IVFIndex.load(base, path, nprobe)
+    logger.info(f"Building ivf index with {nlist} lists over {len(base)} articles")
+    index = IVFIndex.build(base, nlist, nprobe)
+    if path is not None:
+        index.save(path)
+    return index
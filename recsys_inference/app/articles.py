@@ -0,0 +1,44 @@
+from typing import Any, List, NamedTuple, Optional
+
+from numpy import ndarray
+
+from app.attributes import Attributes
+from app.index import EmbeddingIndex
+from app.neighbor_table import NeighborTable
+
+
+class Articles(NamedTuple):
+    """
+    Snapshot of everything used to recommend articles. Requests take the current snapshot once
+    and use it to the end, upsert builds a new snapshot which replaces the current one as a whole
+    @index: exact index which holds ids and vectors
+    @search: index used for search: the exact one, IVFIndex or QuantizedIndex over it
+    @table: precomputed neighbors of articles or None
+    @attributes: columns used by filters, rows are aligned with the index
+    """
+    index: EmbeddingIndex
+    search: Any
+    table: Optional[NeighborTable] = None
+    attributes: Optional[Attributes] = None
+
+    def upsert(self, ids: List[str], vectors: ndarray, records: Optional[List[dict]] = None) -> "Articles":
+        """
+        @records: attributes of upserted articles (year, venue, tags), unknown if not given
+        """
+        index, rows = self.index.upsert(ids, vectors)
+        search = index if self.search is self.index else self.search.upsert(index, rows)
+        table = None if self.table is None else self.table.with_index(index, rows)
+        attributes = self.attributes or Attributes.empty(len(self.index))
+        attributes = attributes.upsert(rows, records or [{} for _ in ids])
+        return Articles(index, search, table, attributes)
+
+    def mask(self, filters: dict) -> Optional[ndarray]:
+        """
+        @filters: keyword arguments of Attributes.mask
+        return: mask of rows which pass filters or None when there are no filters
+        """
+        filters = {name: value for name, value in filters.items() if value is not None}
+        if not filters:
+            return None
+        attributes = self.attributes or Attributes.empty(len(self.index))
+        return attributes.mask(**filters)
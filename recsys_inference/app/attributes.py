@@ -0,0 +1,181 @@
+"""
+Attribute columns of articles stored next to the embeddings, rows are aligned with the embeddings store.
+
+<store>/year.npy          int16 year of every article, 0 if unknown
+<store>/venue.npy         int32 code of the venue, -1 if unknown
+<store>/venues.json       list of venue names, code is the position in the list
+<store>/tag_indptr.npy    tags of row i are tag_codes[tag_indptr[i]:tag_indptr[i + 1]]
+<store>/tag_codes.npy     int32 codes of tags
+<store>/tags.json         list of tag names
+
+Build from json lines {"id": ..., "year": ..., "venue": ..., "tags": [...]}:
+    python -m app.attributes build app/models/articles_store articles_attributes.jsonl
+"""
+import os
+import sys
+import json
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from numpy import ndarray
+
+from app.index import grow
+from app.store import open_store
+
+logger = logging.getLogger("logging_service")
+
+YEAR_FILE = "year.npy"
+VENUE_FILE = "venue.npy"
+VENUES_FILE = "venues.json"
+TAG_INDPTR_FILE = "tag_indptr.npy"
+TAG_CODES_FILE = "tag_codes.npy"
+TAGS_FILE = "tags.json"
+
+
+class Attributes:
+    """
+    Columns used to filter search results, all predicates are evaluated as vectorized masks over rows
+    @year: int16 ndarray, 0 for unknown year
+    @venue: int32 ndarray of venue codes, -1 for unknown venue
+    @venues: venue names
+    @tag_indptr, @tag_codes: tags of every row in CSR layout
+    @tags: tag names
+    """
+
+    def __init__(self, year: ndarray, venue: ndarray, venues: List[str],
+                 tag_indptr: ndarray, tag_codes: ndarray, tags: List[str]):
+        self.year = year
+        self.venue = venue
+        self.venues = venues
+        self.venue_codes = {name: code for code, name in enumerate(venues)}
+        self.tag_indptr = tag_indptr
+        self.tag_codes = tag_codes
+        self.tags = tags
+        self.tag_ids = {name: code for code, name in enumerate(tags)}
+
+    def __len__(self) -> int:
+        return len(self.tag_indptr) - 1
+
+    @classmethod
+    def build(cls, ids: ndarray, records: Iterable[dict]) -> "Attributes":
+        """
+        @ids: ids of the embeddings store, articles without a record get unknown attributes
+        @records: dicts with id, year, venue and tags keys
+        """
+        by_id = {record["id"]: record for record in records}
+        attributes = cls.empty(0)
+        rows = np.arange(len(ids))
+        return attributes.upsert(rows, [by_id.get(article_id, {}) for article_id in ids.tolist()])
+
+    @classmethod
+    def empty(cls, n: int) -> "Attributes":
+        return cls(np.zeros(n, dtype=np.int16), np.full(n, -1, dtype=np.int32), [],
+                   np.zeros(n + 1, dtype=np.int64), np.empty(0, dtype=np.int32), [])
+
+    def save(self, path: str):
+        np.save(os.path.join(path, YEAR_FILE), self.year)
+        np.save(os.path.join(path, VENUE_FILE), self.venue)
+        np.save(os.path.join(path, TAG_INDPTR_FILE), self.tag_indptr)
+        np.save(os.path.join(path, TAG_CODES_FILE), self.tag_codes)
+        with open(os.path.join(path, VENUES_FILE), "w") as f:
+            json.dump(self.venues, f)
+        with open(os.path.join(path, TAGS_FILE), "w") as f:
+            json.dump(self.tags, f)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, YEAR_FILE))
+
+    @classmethod
+    def load(cls, path: str) -> "Attributes":
+        with open(os.path.join(path, VENUES_FILE)) as f:
+            venues = json.load(f)
+        with open(os.path.join(path, TAGS_FILE)) as f:
+            tags = json.load(f)
+        return cls(
+            np.load(os.path.join(path, YEAR_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, VENUE_FILE), mmap_mode="r"),
+            venues,
+            np.load(os.path.join(path, TAG_INDPTR_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, TAG_CODES_FILE), mmap_mode="r"),
+            tags,
+        )
+
+    def upsert(self, rows: ndarray, records: List[dict]) -> "Attributes":
+        """
+        @rows: rows appended to the embeddings index by upsert, rows[0] == len(self)
+        @records: attributes of these rows, missing keys mean unknown values
+        return: new attributes, this object is not changed
+        """
+        n = len(self)
+        venues, tags = list(self.venues), list(self.tags)
+        venue_codes, tag_ids = dict(self.venue_codes), dict(self.tag_ids)
+
+        def code(name: str, names: List[str], codes: Dict[str, int]) -> int:
+            if name not in codes:
+                codes[name] = len(names)
+                names.append(name)
+            return codes[name]
+
+        new_tags = [[code(tag, tags, tag_ids) for tag in record.get("tags") or []] for record in records]
+        lengths = np.array([len(row_tags) for row_tags in new_tags], dtype=np.int64)
+        new_indptr = self.tag_indptr[n] + np.cumsum(lengths)
+
+        year = grow(self.year, n, len(rows))
+        venue = grow(self.venue, n, len(rows))
+        tag_indptr = grow(self.tag_indptr, n + 1, len(rows))
+        tag_codes = grow(self.tag_codes, self.tag_indptr[n], int(lengths.sum()))
+        year[rows] = [record.get("year") or 0 for record in records]
+        venue[rows] = [code(record["venue"], venues, venue_codes) if record.get("venue") else -1
+                       for record in records]
+        tag_indptr[rows + 1] = new_indptr
+        tag_codes[self.tag_indptr[n]:self.tag_indptr[n] + lengths.sum()] = [t for row_tags in new_tags for t in row_tags]
+        return Attributes(year[:n + len(rows)], venue[:n + len(rows)], venues,
+                          tag_indptr[:n + len(rows) + 1], tag_codes[:self.tag_indptr[n] + lengths.sum()], tags)
+
+    def subset(self, rows: ndarray) -> "Attributes":
+        """
+        return: attributes of the given rows only, used by a shard which holds a part of the store
+        """
+        lengths = np.diff(self.tag_indptr)[rows]
+        starts = np.repeat(self.tag_indptr[rows], lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return Attributes(
+            np.asarray(self.year[rows]), np.asarray(self.venue[rows]), self.venues,
+            np.concatenate([[0], np.cumsum(lengths)]), np.asarray(self.tag_codes[starts + offsets]), self.tags,
+        )
+
+    def mask(self, year_from: Optional[int] = None, year_to: Optional[int] = None,
+             venue: Optional[str] = None, tag: Optional[str] = None) -> Optional[ndarray]:
+        """
+        return: bool ndarray, True for rows which satisfy all given predicates, None if no predicate is given
+        """
+        if year_from is None and year_to is None and venue is None and tag is None:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        if year_from is not None or year_to is not None:
+            mask &= self.year > 0
+        if year_from is not None:
+            mask &= self.year >= year_from
+        if year_to is not None:
+            mask &= self.year <= year_to
+        if venue is not None:
+            mask &= self.venue == self.venue_codes.get(venue, -2)
+        if tag is not None:
+            with_tag = np.zeros(len(self), dtype=bool)
+            tag_rows = np.repeat(np.arange(len(self)), np.diff(self.tag_indptr))
+            with_tag[tag_rows[self.tag_codes[:self.tag_indptr[-1]] == self.tag_ids.get(tag, -1)]] = True
+            mask &= with_tag
+        return mask
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        print(__doc__)
+        sys.exit(1)
+    store_ids, _ = open_store(sys.argv[2])
+    with open(sys.argv[3]) as f:
+        attributes = Attributes.build(np.asarray(store_ids), (json.loads(line) for line in f if line.strip()))
+    attributes.save(sys.argv[2])
+    logger.info(f"Attributes of {len(attributes)} articles saved to {sys.argv[2]}")
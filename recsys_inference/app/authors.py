@@ -0,0 +1,135 @@
+"""
+Co-author recommendations over author entities only, their ids never mix with articles.
+
+<coauthors.tsv>    author_id<TAB>coauthor_id lines in both directions, exported from the backend:
+                       python -m app.db.export_coauthors coauthors.tsv   (run in backend)
+<store>            embeddings store of authors in the format of app.store
+
+Offline build of the authors store from the graph model:
+    python -m app.authors build app/models/graph_model.pkl app/models/coauthors.tsv app/models/authors_store
+"""
+import sys
+import argparse
+import logging
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from app.index import EmbeddingIndex
+from app.store import open_store, write_store
+
+logger = logging.getLogger("logging_service")
+
+EMBED_BLOCK_SIZE = 65536
+
+
+def read_edges(path: str) -> Iterator[Tuple[str, str]]:
+    with open(path) as f:
+        for line in f:
+            author_id, _, coauthor_id = line.rstrip("\n").partition("\t")
+            if coauthor_id:
+                yield author_id, coauthor_id
+
+
+def author_ids(edges: Iterable[Tuple[str, str]]) -> List[str]:
+    return sorted({author_id for edge in edges for author_id in edge})
+
+
+def author_embeddings(model, ids: List[str]) -> Tuple[List[str], ndarray]:
+    """
+    return: (ids, embeddings) of authors known to the graph model, unknown authors are skipped
+    """
+    known = [author_id for author_id in ids if author_id in model.ent_to_idx]
+    if len(known) < len(ids):
+        logger.info(f"{len(ids) - len(known)} authors are unknown to the model")
+    vectors = np.concatenate([
+        model.get_embeddings(known[start:start + EMBED_BLOCK_SIZE])
+        for start in range(0, len(known), EMBED_BLOCK_SIZE)
+    ]) if known else np.empty((0, 0), dtype=np.float32)
+    return known, vectors
+
+
+class CoauthorIndex:
+    """
+    @index: embeddings of authors
+    @indptr, @coauthors: co-authors of row i of the index are rows coauthors[indptr[i]:indptr[i + 1]]
+    """
+
+    def __init__(self, index: EmbeddingIndex, indptr: ndarray, coauthors: ndarray):
+        self.index = index
+        self.indptr = indptr
+        self.coauthors = coauthors
+
+    @classmethod
+    def build(cls, index: EmbeddingIndex, edges: Iterable[Tuple[str, str]]) -> "CoauthorIndex":
+        """
+        @edges: (author_id, coauthor_id) pairs, pairs with authors missing in the index are skipped
+        """
+        pairs = np.array([
+            (index.id_to_row.get(author_id, -1), index.id_to_row.get(coauthor_id, -1))
+            for author_id, coauthor_id in edges
+        ], dtype=np.int64).reshape(-1, 2)
+        pairs = np.unique(pairs[(pairs >= 0).all(axis=1)], axis=0)  # отсортированы по первому столбцу
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(pairs[:, 0], minlength=len(index)))])
+        return cls(index, indptr, pairs[:, 1].astype(np.int32))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, author_id: str) -> bool:
+        return author_id in self.index.id_to_row
+
+    def coauthors_of(self, author_id: str) -> List[str]:
+        row = self.index.id_to_row[author_id]
+        return self.index.ids[self.coauthors[self.indptr[row]:self.indptr[row + 1]]].tolist()
+
+    def recommend(self, author_id: str, k: int, exclude_coauthors: bool = True) -> List[str]:
+        """
+        return: k authors closest to the author, the author and optionally the co-authors are excluded
+        """
+        row = self.index.id_to_row[author_id]
+        exclude = [author_id] + (self.coauthors_of(author_id) if exclude_coauthors else [])
+        neighbors, _ = self.index.search(self.index.vectors[row], k, exclude=exclude)
+        return neighbors.tolist()
+
+
+def load_coauthor_index(store_path: str, edges_path: Optional[str]) -> CoauthorIndex:
+    index = EmbeddingIndex(*open_store(store_path), normalized=True)
+    edges = read_edges(edges_path) if edges_path is not None else ()
+    coauthor_index = CoauthorIndex.build(index, edges)
+    logger.info(f"Co-author index: {len(index)} authors, {len(coauthor_index.coauthors)} co-author pairs")
+    return coauthor_index
+
+
+def build_store(model, edges_path: str, store_path: str) -> bool:
+    """
+    Writes embeddings of all authors from the co-author edges to the store, one model call per block of authors
+    return: False if no author of the edges is known to the model, the store is not written then
+    """
+    ids, vectors = author_embeddings(model, author_ids(read_edges(edges_path)))
+    if not ids:
+        logger.warning(f"No author from {edges_path} is known to the model, authors store is not written")
+        return False
+    write_store(store_path, ids, vectors)
+    logger.info(f"Authors store with {len(ids)} authors saved to {store_path}")
+    return True
+
+
+def main():
+    from ampligraph.utils import restore_model
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("model", help="pickled graph model")
+    parser.add_argument("edges", help="co-author edges exported from the backend")
+    parser.add_argument("output", help="directory of the authors store")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not build_store(restore_model(args.model), args.edges, args.output):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
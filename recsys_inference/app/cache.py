@@ -0,0 +1,75 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Thread safe in-process cache bounded by size with optional time to live
+    @maxsize: max number of entries, least recently used entries are evicted first
+    @ttl: entry lifetime in seconds, None for entries which never expire
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl is not None and self.timer() - item[1] > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, self.timer())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,84 @@
+import time
+import asyncio
+import logging
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger("logging_service")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _timed_call(fn: Callable, *args):
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time()
+
+
+class BoundedExecutor:
+    """
+    Runs CPU bound work off the asyncio event loop
+    @kind: "thread" for numpy work which releases the GIL inside BLAS,
+           "process" for python heavy work, workers are forked after the model is loaded
+    @max_workers: number of requests computed at the same time
+    @max_queue: number of requests waiting for a free worker, over it run raises QueueFullError
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 4, max_queue: int = 64):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rejected = 0
+        self._pool = None
+
+    def start(self):
+        if self.kind == "thread":
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="recsys")
+        else:
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("fork"))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            self.start()
+        return self._pool
+
+    async def run(self, name: str, fn: Callable, *args):
+        # pending меняется только из event loop, поэтому блокировка не нужна
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"{self.pending} requests are already in progress")
+        self.pending += 1
+        submitted = time.time()
+        try:
+            loop = asyncio.get_event_loop()
+            result, started, finished = await loop.run_in_executor(
+                self.pool, functools.partial(_timed_call, fn, *args)
+            )
+        finally:
+            self.pending -= 1
+        logger.info(
+            f"{name}: waited {(started - submitted) * 1000:.1f} ms, "
+            f"computed {(finished - started) * 1000:.1f} ms, pending {self.pending}"
+        )
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,254 @@
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+
+def normalize_rows(matrix: ndarray) -> ndarray:
+    """
+    @matrix: ndarray of shape (n, dim)
+    return: float32 copy of matrix where every non-zero row has unit length
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.
+    return matrix / norms
+
+
+def top_k(scores: ndarray, k: int) -> ndarray:
+    """
+    @scores: 1d ndarray of similarities, excluded positions are set to -inf
+    @k: number of positions to be returned
+    return: positions of at most k largest finite scores, sorted from the best one
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    best = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return best[np.isfinite(scores[best])]
+
+
+def grow(buffer: ndarray, n: int, extra: int, dtype=None) -> ndarray:
+    """
+    @buffer: ndarray whose first n rows are used
+    @extra: number of rows to be appended after the first n
+    return: buffer itself if it is writable and has room, otherwise a new buffer with amortized
+            extra capacity and the first n rows copied, so rows after n may be written without
+            touching rows visible to older snapshots
+    """
+    dtype = buffer.dtype if dtype is None else np.result_type(buffer.dtype, dtype)
+    if n + extra <= len(buffer) and buffer.flags.writeable and dtype == buffer.dtype:
+        return buffer
+    capacity = max(n + extra, n + n // 4 + 1024)
+    grown = np.empty((capacity,) + buffer.shape[1:], dtype=dtype)
+    grown[:n] = buffer[:n]
+    return grown
+
+
+class IdMap:
+    """
+    Mapping id -> row which is updated without copying all ids: frozen base dict and small delta dict
+    on top of it, delta is merged into a new base when it grows to a quarter of the base
+    """
+
+    def __init__(self, base: dict, delta: dict = None):
+        self.base = base
+        self.delta = delta or {}
+
+    def get(self, key, default=None):
+        row = self.delta.get(key)
+        if row is None:
+            return self.base.get(key, default)
+        return row
+
+    def __getitem__(self, key) -> int:
+        row = self.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __contains__(self, key) -> bool:
+        return key in self.delta or key in self.base
+
+    def updated(self, mapping: dict) -> "IdMap":
+        delta = dict(self.delta)
+        delta.update(mapping)
+        if len(delta) > max(1024, len(self.base) // 4):
+            base = dict(self.base)
+            base.update(delta)
+            return IdMap(base)
+        return IdMap(self.base, delta)
+
+
+class EmbeddingIndex:
+    """
+    Exact cosine nearest neighbours search over one contiguous matrix of embeddings.
+    The index is an immutable snapshot: upsert returns a new index which shares buffers with this one
+    @ids: ids of articles, ids[i] is the id of the i-th row of vectors
+    @vectors: ndarray of shape (len(ids), dim)
+    @normalized: True if the rows of vectors already have unit length
+    """
+
+    def __init__(self, ids: Iterable[str], vectors: ndarray, normalized: bool = False):
+        self._ids = np.asarray(ids)
+        if normalized:
+            self._vectors = np.asarray(vectors, dtype=np.float32)
+        else:
+            self._vectors = normalize_rows(vectors)
+        self.n = len(self._ids)
+        self.id_to_row = IdMap({article_id: row for row, article_id in enumerate(self._ids.tolist())})
+        # строки, замененные через upsert, остаются в матрице, но не участвуют в поиске
+        self.dead_rows = np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def from_dict(cls, embeddings: dict) -> "EmbeddingIndex":
+        ids = np.array(list(embeddings.keys()))
+        vectors = np.empty((len(ids), len(next(iter(embeddings.values())))), dtype=np.float32)
+        for row, vector in enumerate(embeddings.values()):
+            vectors[row] = vector
+        return cls(ids, vectors)
+
+    @property
+    def ids(self) -> ndarray:
+        return self._ids[:self.n]
+
+    @property
+    def vectors(self) -> ndarray:
+        return self._vectors[:self.n]
+
+    def upsert(self, ids: List[str], vectors: ndarray) -> Tuple["EmbeddingIndex", ndarray]:
+        """
+        Appends new ids and replaces embeddings of known ids. Replaced rows are marked dead and new
+        rows are appended, so readers of this snapshot never see the change
+        @ids: unique ids of articles
+        @vectors: ndarray of shape (len(ids), dim)
+        return: (index, rows) where index is the new snapshot and rows are rows of ids in it
+        """
+        ids = np.asarray(ids)
+        rows = np.arange(self.n, self.n + len(ids))
+        replaced = self.rows(ids.tolist())
+
+        index = EmbeddingIndex.__new__(EmbeddingIndex)
+        index._ids = grow(self._ids, self.n, len(ids), ids.dtype)
+        index._vectors = grow(self._vectors, self.n, len(ids))
+        index._ids[rows] = ids
+        index._vectors[rows] = normalize_rows(vectors)
+        index.n = self.n + len(ids)
+        index.id_to_row = self.id_to_row.updated(dict(zip(ids.tolist(), rows.tolist())))
+        index.dead_rows = np.union1d(self.dead_rows, replaced)
+        return index, rows
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def n_live(self) -> int:
+        """
+        return: number of articles, rows replaced by upsert are not counted
+        """
+        return self.n - len(self.dead_rows)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def rows(self, ids: Iterable[str]) -> ndarray:
+        """
+        return: rows of ids which are present in the index, unknown ids are skipped
+        """
+        rows = [self.id_to_row[i] for i in ids if i in self.id_to_row]
+        return np.array(rows, dtype=np.int64)
+
+    def excluded_rows(self, exclude: Iterable[str]) -> ndarray:
+        """
+        return: rows of exclude together with dead rows, none of them may be returned by search
+        """
+        return np.concatenate([self.rows(exclude), self.dead_rows])
+
+    def scores(self, query: ndarray) -> ndarray:
+        """
+        return: cosine similarity between query and every row of the index
+        """
+        query = normalize_rows(query)
+        return self.vectors @ query
+
+    def search(self, query: ndarray, k: int, exclude: Iterable[str] = (), mask: Optional[ndarray] = None,
+               **params) -> Tuple[ndarray, ndarray]:
+        """
+        @query: embedding of shape (dim,)
+        @k: number of nearest neighbors to be returned
+        @exclude: ids which must not be returned (for example articles already seen by user)
+        @mask: bool ndarray of shape (len(self),), only rows where it is True may be returned
+        @params: parameters of approximate indexes (nprobe), exact search ignores them
+        return: (ids, dist) of k nearest neighbors sorted by cosine distance,
+                less than k only if less than k rows pass exclude and mask
+        """
+        scores = self.scores(query)
+        scores[self.excluded_rows(exclude)] = -np.inf
+        if mask is not None:
+            scores[~mask] = -np.inf
+        best = top_k(scores, k)
+        return self.ids[best], 1. - scores[best]
+
+    def search_batch(self, queries: ndarray, k: int, excludes: List[Iterable[str]],
+                     block_size: int = 2048, mask: Optional[ndarray] = None) -> List[Tuple[ndarray, ndarray]]:
+        """
+        Exact search for many queries with one blocked matrix multiply: queries and rows of the index
+        are processed in blocks of block_size, so at most block_size x block_size scores are held at once
+        @queries: ndarray of shape (n_queries, dim)
+        @excludes: ids to be excluded for every query
+        @mask: bool ndarray of shape (len(self),), only rows where it is True may be returned for any query
+        return: list of (ids, dist) for every query, as returned by search
+        """
+        queries = normalize_rows(queries)
+        results = []
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            best_scores, best_rows = self.search_batch_rows(
+                block, k, excludes[start:start + block_size], block_size, mask
+            )
+            for scores, rows in zip(best_scores, best_rows):
+                found = np.isfinite(scores)
+                results.append((self.ids[rows[found]], 1. - scores[found]))
+        return results
+
+    def search_batch_rows(self, queries: ndarray, k: int, excludes: List[Iterable[str]],
+                          block_size: int, mask: Optional[ndarray] = None) -> Tuple[ndarray, ndarray]:
+        """
+        @queries: normalized ndarray of shape (n_queries, dim), n_queries <= block_size
+        return: (scores, rows) of shape (n_queries, min(k, len(self))) sorted from the best one,
+                scores of missing neighbors are -inf
+        """
+        k = min(k, len(self))
+        excluded = [(i, row) for i, exclude in enumerate(excludes) for row in self.rows(exclude)]
+        excluded_queries = np.array([i for i, _ in excluded], dtype=np.int64)
+        excluded_rows = np.array([row for _, row in excluded], dtype=np.int64)
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), k), dtype=np.int64)
+        for start in range(0, len(self), block_size):
+            scores = queries @ self.vectors[start:start + block_size].T
+            in_block = (excluded_rows >= start) & (excluded_rows < start + scores.shape[1])
+            scores[excluded_queries[in_block], excluded_rows[in_block] - start] = -np.inf
+            dead_in_block = self.dead_rows[(self.dead_rows >= start) & (self.dead_rows < start + scores.shape[1])]
+            scores[:, dead_in_block - start] = -np.inf
+            if mask is not None:
+                scores[:, ~mask[start:start + scores.shape[1]]] = -np.inf
+            if scores.shape[1] > k:
+                positions = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, positions, axis=1)
+            else:
+                positions = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            # сливаем лучшие k из текущего блока с лучшими k из предыдущих
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_rows = np.concatenate([best_rows, positions + start], axis=1)
+            keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+            best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
@@ -1,18 +1,32 @@
 import os
+import time
 import pickle
+import threading
 import uvicorn
 import logging
 import numpy as np
 import math
-import gdown
-from fastapi import FastAPI, status
+import httpx
+from fastapi import FastAPI, HTTPException, status
 from typing import List, Tuple
 from numpy import ndarray
 from ampligraph.discovery import find_nearest_neighbours
 from ampligraph.utils import restore_model
-from scipy.spatial import distance
 
 from app import schemas
+from common.artifacts import fetch
+from app.ann import make_search_index
+from app.articles import Articles
+from app.attributes import Attributes
+from app.authors import build_store, load_coauthor_index
+from app.cache import LRUCache
+from app.executor import BoundedExecutor, QueueFullError
+from app.index import EmbeddingIndex
+from app.neighbor_table import NeighborTable
+from app.profiles import ProfileStore
+from app.quantization import PQ_M, make_quantized_index
+from app.sharding import ShardClient, partition_rows, shard_of
+from app.store import convert_npy, open_store, store_exists
 
 
 app = FastAPI()
@@ -29,6 +43,42 @@ logger.addHandler(stream_handler)
 model_name = "Graph model"
 version = "v1.0.0"
 model = None
+started_at = None
+# single - весь корпус в одном процессе, shard - часть корпуса, coordinator - модель и рассылка запросов по шардам
+role = os.environ.get("RECSYS_ROLE", "single")
+shard_id = int(os.environ.get("SHARD_ID", 0))
+num_shards = int(os.environ.get("NUM_SHARDS", 1))
+shard_client = None
+batch_block_size = int(os.environ.get("BATCH_BLOCK_SIZE", 2048))
+# пользователи часто обновляют страницу рекомендаций с той же историей
+neighbors_cache = LRUCache(
+    maxsize=int(os.environ.get("RESULT_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 600)),
+)
+executor = BoundedExecutor(
+    kind=os.environ.get("EXECUTOR_KIND", "thread"),
+    max_workers=int(os.environ.get("EXECUTOR_WORKERS", 4)),
+    max_queue=int(os.environ.get("EXECUTOR_QUEUE", 64)),
+)
+# профили активных пользователей, обновляются по одной открытой статье
+profiles = ProfileStore(
+    maxsize=int(os.environ.get("PROFILE_CACHE_SIZE", 50000)),
+    decay=float(os.environ.get("PROFILE_DECAY", 0.9)),
+)
+# текущий снимок индексов статей, заменяется целиком при upsert
+articles = None
+# эмбеддинги только авторов и их соавторы, id авторов не смешиваются со статьями
+coauthors = None
+upsert_lock = threading.Lock()
+
+
+COLD_START_NEIGHBORS = [
+    '53e9986eb7602d97020ab93b',
+    '53e9b587b7602d97040c7931',
+    '53e9bb52b7602d9704790954',
+    '53e9a95db7602d97032b5715',
+    '53e9983db7602d9702065035'
+]
 
 
 @app.get("/")
@@ -41,29 +91,26 @@ def main() -> str:
 async def model_info() -> dict:
     return {
         "name": model_name,
-        "version": version
+        "version": version,
+        "cache": neighbors_cache.stats(),
+        "executor": executor.stats(),
+        "profiles": profiles.stats(),
     }
 
 
 @app.on_event("startup")
 def load_model():
+    global started_at
+    started_at = time.monotonic()
     logger.info("Server started")
+    if role == "shard":
+        logger.info(f"Shard {shard_id} of {num_shards} does not load the model")
+        return
     logger.info("Start loading model")
     global model
-    url = os.environ["MODEL_LINK"]
-    if url is None:
-        err = f"Link to model {url} is None"
-        logger.info(err)
-        raise RuntimeError(err)
-
     model_path = os.environ["MODEL_PATH"]
-
-    gdown.download(
-        url=url,
-        output=model_path,
-        quiet=False,
-        fuzzy=True,
-    )
+    # скачиваем, только если модели нет в локальном кэше или она не совпадает с манифестом
+    fetch(model_path, os.environ.get("MODEL_LINK"))
 
     model = restore_model(model_path)
     logger.info("Model was loaded successful")
@@ -71,7 +118,7 @@ def load_model():
 
 @app.get("/health")
 def health_model():
-    if model is None:
+    if model is None and role != "shard":
         return status.HTTP_503_SERVICE_UNAVAILABLE
     return status.HTTP_200_OK
 
@@ -95,93 +142,412 @@ def get_neighbors_one_entities(
     return neighbors, dist
 
 
+def shard_path(path):
+    # индексы шарда построены по его части строк, поэтому у каждого шарда свой файл
+    if path is None or role != "shard":
+        return path
+    return f"{path}.shard{shard_id}of{num_shards}"
+
+
 @app.on_event("startup")
 def load_all_embeddings():
+    if role == "coordinator":
+        global shard_client
+        shard_client = ShardClient(
+            os.environ["SHARD_URLS"].split(","), timeout=float(os.environ.get("SHARD_TIMEOUT", 5))
+        )
+        logger.info(f"Coordinator of shards {shard_client.urls}")
+        return
     logger.info("Start loading embeddings")
-    url = os.environ["ARTICLE_EMBED"]
-    if url is None:
-        err = f"Link to aticles embeddings {url} is None"
+    store_path = os.environ.get("ARTICLE_EMBED_STORE", "app/models/articles_store")
+    if not store_exists(store_path):
+        article_embed__path = os.environ["ARTICLE_EMBED_PATH"]
+        fetch(article_embed__path, os.environ.get("ARTICLE_EMBED"))
+        # одноразовая конвертация словаря из .npy в формат для np.memmap
+        convert_npy(article_embed__path, store_path)
+    ids, vectors = open_store(store_path)
+    if role == "shard":
+        # в память шарда попадает только его часть матрицы
+        rows = partition_rows(np.asarray(ids), shard_id, num_shards)
+        ids, vectors = np.asarray(ids[rows]), np.asarray(vectors[rows])
+        logger.info(f"Shard {shard_id} of {num_shards}: {len(rows)} articles")
+    articles_index = EmbeddingIndex(ids, vectors, normalized=True)
+    logger.info(f"Embeddings load successful: {len(articles_index)} articles, dim {articles_index.dim}")
+    ann_index = os.environ.get("ANN_INDEX", "exact")
+    quantization = os.environ.get("EMBED_QUANTIZATION", "none")
+    if quantization != "none" and ann_index != "exact":
+        err = f"EMBED_QUANTIZATION={quantization} is supported only with ANN_INDEX=exact"
         logger.info(err)
         raise RuntimeError(err)
-    article_embed__path = os.environ["ARTICLE_EMBED_PATH"]
-    gdown.download(
-        url=url,
-        output=article_embed__path,
-        quiet=False,
-        fuzzy=True,
-    )
-    global articles_embeddings
-    with open(article_embed__path, 'rb') as f:
-        articles_embeddings = np.load(f, allow_pickle=True).item()
-    logger.info("Embeddings load successful")
+    pq_m = int(os.environ.get("PQ_M", PQ_M))
+    if quantization == "pq" and articles_index.dim % pq_m:
+        err = f"PQ_M={pq_m} does not divide embedding dimension {articles_index.dim}"
+        logger.info(err)
+        raise RuntimeError(err)
+    if quantization != "none":
+        articles_search = make_quantized_index(
+            articles_index,
+            kind=quantization,
+            path=shard_path(os.environ.get("EMBED_CODES_PATH")),
+            rerank=int(os.environ.get("EMBED_RERANK", 0)),
+            pq_m=pq_m,
+        )
+    else:
+        articles_search = make_search_index(
+            articles_index,
+            kind=ann_index,
+            path=shard_path(os.environ.get("ANN_INDEX_PATH")),
+            nlist=int(os.environ.get("IVF_NLIST", 1024)),
+            nprobe=int(os.environ.get("IVF_NPROBE", 16)),
+        )
+    logger.info(f"Search index is {type(articles_search).__name__}")
+
+    neighbor_table = None
+    neighbor_table_path = os.environ.get("NEIGHBOR_TABLE_PATH")
+    if role == "shard":
+        logger.info("Neighbor table is not used by shards")
+    elif neighbor_table_path is not None and os.path.exists(neighbor_table_path):
+        neighbor_table = NeighborTable.load(articles_index, neighbor_table_path)
+        logger.info(f"Neighbor table with {neighbor_table.k} neighbors per article loaded")
+    else:
+        logger.info("Neighbor table not found, single articles are searched live")
+
+    attributes = None
+    if Attributes.exists(store_path):
+        attributes = Attributes.load(store_path)
+        if role == "shard":
+            attributes = attributes.subset(rows)
+        logger.info(f"Attributes loaded: {len(attributes.venues)} venues, {len(attributes.tags)} tags")
+
+    global articles
+    articles = Articles(articles_index, articles_search, neighbor_table, attributes)
+
+
+@app.on_event("startup")
+def load_authors():
+    global coauthors
+    if role == "shard":
+        return
+    store_path = os.environ.get("AUTHOR_EMBED_STORE", "app/models/authors_store")
+    edges_path = os.environ.get("COAUTHORS_PATH")
+    if edges_path is not None and not os.path.exists(edges_path):
+        edges_path = None
+    if not store_exists(store_path):
+        if edges_path is None:
+            logger.info("Neither authors store nor co-author edges found, co-authors are searched by the graph model")
+            return
+        # эмбеддинги авторов достаем из модели один раз и сохраняем рядом с эмбеддингами статей
+        if not build_store(model, edges_path, store_path):
+            logger.info("Co-authors are searched by the graph model")
+            return
+    coauthors = load_coauthor_index(store_path, edges_path)
+
+
+@app.on_event("startup")
+def start_executor():
+    # пул процессов форкается после загрузки модели и эмбеддингов, чтобы воркеры получили их копию
+    executor.start()
+    logger.info(f"Executor started: {executor.stats()}")
+
+
+@app.on_event("startup")
+def report_ready():
+    logger.info(f"Ready in {time.monotonic() - started_at:.1f}s since server start")
+
+
+@app.on_event("shutdown")
+async def stop_executor():
+    executor.shutdown()
+    if shard_client is not None:
+        await shard_client.close()
 
 
 @app.get("/health")
 def health_embeddings():
-    if articles_embeddings is None:
+    if articles is None and shard_client is None:
         return status.HTTP_503_SERVICE_UNAVAILABLE
     return status.HTTP_200_OK
 
 
-def find_nearest_neighbors(receive_id, k, mean_article):
-    dict_dists = dict()
-    for key, val in articles_embeddings.items():
-        dict_dists[key] = distance.cosine(mean_article, val)
-    sorted_dict_dists = dict(sorted(dict_dists.items(), key=lambda kv: kv[1]))
-    nearest_neighbor = []
-    list_keys = list(sorted_dict_dists.keys())
+def find_nearest_neighbors(articles, receive_id, k, mean_article, nprobe=None, mask=None):
     # не хотим рекомендовать пользователю статьи, которые он уже видел, поэтому исключаем статьи с ключами из receive_id
-    i = 0
-    while True:
-        if list_keys[i] not in receive_id:
-            nearest_neighbor.append(list_keys[i])
-            i += 1
-        else:
-            i += 1
-        if len(nearest_neighbor) >= k:
-            break
-    return nearest_neighbor
+    # фильтры по году, месту публикации и тегу приходят маской строк и применяются прямо при подсчете близости
+    nearest_neighbor, _ = articles.search.search(mean_article, k, exclude=receive_id, mask=mask, nprobe=nprobe)
+    return nearest_neighbor.tolist()
+
 
+def get_neighbors_for_article(articles, article_id, k, nprobe=None, mask=None):
+    if articles.table is not None and mask is None:
+        neighbors = articles.table.lookup(article_id, k)
+        if neighbors is not None:
+            return neighbors
+    article = articles.index.vectors[articles.index.id_to_row[article_id]]
+    return find_nearest_neighbors(articles, [article_id], k, article, nprobe, mask)
 
-def get_neighbors_for_user(receive_id, k):
-    n = len(receive_id)
+
+def history_weights(n):
     weights = np.zeros(n)
     for i in range(n):
         weights[n - i - 1] = 1. / math.log(i + 2)  # хотим чтобы веса увеличивались слева направо
         #  так как статьи приходят от самой поздней к самой новой
-    weights = weights / sum(weights)
-    articles = model.get_embeddings(receive_id)
-    mean_article = np.average(articles, axis=0, weights=weights)
+    return weights / sum(weights)
+
+
+def user_vectors(receive_ids):
+    """
+    @receive_ids: non-empty histories of users
+    return: ndarray of weighted mean embeddings of shape (len(receive_ids), dim)
+    """
+    # эмбеддинги всех статей из всех историй достаем одним вызовом модели
+    unique_ids = list({article_id for receive_id in receive_ids for article_id in receive_id})
+    rows = {article_id: row for row, article_id in enumerate(unique_ids)}
+    embeddings = model.get_embeddings(unique_ids)
+    return np.stack([
+        np.average(embeddings[[rows[i] for i in receive_id]], axis=0, weights=history_weights(len(receive_id)))
+        for receive_id in receive_ids
+    ])
+
+
+def get_neighbors_for_user(articles, receive_id, k, nprobe=None, mask=None):
+    weights = history_weights(len(receive_id))
+    embeddings = model.get_embeddings(receive_id)
+    mean_article = np.average(embeddings, axis=0, weights=weights)
     # теперь надо по эмбеддингу найти ближайшие статьи и вернуть их
 
-    nearest_neighbors = find_nearest_neighbors(receive_id, k, mean_article)
+    nearest_neighbors = find_nearest_neighbors(articles, receive_id, k, mean_article, nprobe, mask)
     return nearest_neighbors
 
 
-@app.post('/get_neighbors', response_model=schemas.Predictions)
-async def model_predict(input: schemas.ReceiveId):
-    receive_id = input.__dict__['id']
-    n_neighbors = 5
-    if not receive_id:
-        # холодный старт
-        neighbors = [
-            '53e9986eb7602d97020ab93b',
-            '53e9b587b7602d97040c7931',
-            '53e9bb52b7602d9704790954',
-            '53e9a95db7602d97032b5715',
-            '53e9983db7602d9702065035'
-        ]
-    elif len(receive_id) == 1:
-        # либо пользователь посмотрел только одну статью, и ему надо рекомендовать похожие
-        # либо это автор и ему надо рекомендовать соавторов
+def article_embeddings(article_ids):
+    return model.get_embeddings(article_ids)
+
+
+def get_neighbors_for_vector(vector, exclude, k, nprobe=None, filters=None):
+    snapshot = articles
+    mask = snapshot.mask(filters or {})
+    return find_nearest_neighbors(snapshot, exclude, k, vector, nprobe, mask)
+
+
+def get_neighbors_for_users(receive_ids, k, block_size, filters=None):
+    """
+    @receive_ids: non-empty histories of users
+    @filters: filters applied to all users
+    return: list of k nearest neighbors for every user
+    """
+    snapshot = articles
+    mean_articles = user_vectors(receive_ids)
+    mask = snapshot.mask(filters or {})
+    results = snapshot.index.search_batch(mean_articles, k, receive_ids, block_size, mask)
+    return [neighbors.tolist() for neighbors, _ in results]
+
+
+def predict_neighbors(receive_id, n_neighbors, nprobe=None, filters=None):
+    snapshot = articles  # один снимок на весь запрос, даже если параллельно идет upsert
+    mask = snapshot.mask(filters or {})
+    if len(receive_id) == 1 and receive_id[0] in snapshot.index.id_to_row:
+        # пользователь посмотрел только одну статью, и ему надо рекомендовать похожие
+        return get_neighbors_for_article(snapshot, receive_id[0], n_neighbors, nprobe, mask)
+    if len(receive_id) == 1 and coauthors is not None and receive_id[0] in coauthors:
+        # это автор и ему надо рекомендовать соавторов
+        return coauthors.recommend(receive_id[0], n_neighbors)
+    if len(receive_id) == 1:
+        # индекса авторов нет, ищем по всем сущностям модели
         neighbors, dist = get_neighbors_one_entities(
             model, receive_id, n_neighbors
         )
         neighbors = neighbors[0]
-        neighbors = neighbors[1:6].tolist()
+        return neighbors[1:6].tolist()
+    # В этом случае пользователь посмотрел больше одной статьи и мы хотим взять среднее
+    return get_neighbors_for_user(snapshot, receive_id, n_neighbors, nprobe, mask)
+
+
+def recommend_coauthors(author_id, k, exclude_coauthors=True):
+    return coauthors.recommend(author_id, k, exclude_coauthors)
+
+
+async def search_shards(receive_ids, n_neighbors, nprobe=None, filters=None):
+    """
+    Coordinator: user vectors are computed here, nearest neighbors are searched by all shards in parallel
+    """
+    # одна статья в истории идет через общий путь: среднее из одной статьи - это она сама
+    vectors = await run_in_executor("user_vectors", user_vectors, receive_ids)
+    return await search_shards_vectors(vectors, receive_ids, n_neighbors, nprobe, filters)
+
+
+async def search_shards_vectors(vectors, excludes, n_neighbors, nprobe=None, filters=None):
+    try:
+        return await shard_client.search(vectors, n_neighbors, excludes, nprobe, filters)
+    except httpx.HTTPError as err:
+        logger.info(f"Shard request failed: {err!r}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Shard is unavailable")
+
+
+def search_shard(vectors, excludes, k, nprobe=None, filters=None):
+    snapshot = articles
+    mask = snapshot.mask(filters or {})
+    if len(vectors) == 1:
+        return [snapshot.search.search(np.array(vectors[0]), k, excludes[0], mask=mask, nprobe=nprobe)]
+    return snapshot.index.search_batch(np.array(vectors), k, excludes, batch_block_size, mask)
+
+
+async def run_in_executor(name, fn, *args):
+    try:
+        return await executor.run(name, fn, *args)
+    except QueueFullError as err:
+        logger.info(f"{name} rejected: {err}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many requests in progress")
+
+
+async def user_profile(user_id, receive_id):
+    """
+    return: profile of the user, it is built from receive_id once, None if there is neither profile nor history
+    """
+    profile = profiles.get(user_id)
+    if profile is None and receive_id:
+        embeddings = await run_in_executor("user_profile", article_embeddings, receive_id)
+        # пока считались эмбеддинги, профиль мог создать другой запрос или событие
+        profile = profiles.get(user_id) or profiles.build(user_id, receive_id, embeddings)
+    return profile
+
+
+async def get_neighbors_for_profile(profile, n_neighbors, nprobe=None, filters=None):
+    # вектор и просмотренные статьи берем здесь, профиль меняется только в event loop
+    vector, exclude = profile.vector, list(profile.seen)
+    if role == "coordinator":
+        return (await search_shards_vectors(vector[None], [exclude], n_neighbors, nprobe, filters))[0]
+    return await run_in_executor(
+        "get_neighbors_for_profile", get_neighbors_for_vector, vector, exclude, n_neighbors, nprobe, filters
+    )
 
+
+@app.post('/get_neighbors', response_model=schemas.Predictions)
+async def model_predict(input: schemas.ReceiveId):
+    receive_id = input.__dict__['id']
+    n_neighbors = 5
+    filters = schemas.Filters(**input.dict()).dict()
+    profile = None
+    if input.user_id is not None:
+        profile = await user_profile(input.user_id, receive_id)
+    if profile is not None:
+        cache_key = ("profile", input.user_id, profile.version, n_neighbors, input.nprobe, tuple(filters.values()),
+                     version)
+    else:
+        cache_key = (tuple(receive_id), n_neighbors, input.nprobe, tuple(filters.values()), version)
+    cached = neighbors_cache.get(cache_key)
+    if cached is not None:
+        return schemas.Predictions(neighbors=cached)
+    if profile is not None:
+        neighbors = await get_neighbors_for_profile(profile, n_neighbors, input.nprobe, filters)
+    elif not receive_id:
+        # холодный старт
+        neighbors = list(COLD_START_NEIGHBORS)
+    elif role == "coordinator" and len(receive_id) == 1 and coauthors is not None and receive_id[0] in coauthors:
+        neighbors = await run_in_executor("get_coauthors", recommend_coauthors, receive_id[0], n_neighbors)
+    elif role == "coordinator":
+        neighbors = (await search_shards([receive_id], n_neighbors, input.nprobe, filters))[0]
     else:
-        # В этом случае пользователь посмотрел больше одной статьи и мы хотим взять среднее
-        neighbors = get_neighbors_for_user(receive_id, n_neighbors)
+        neighbors = await run_in_executor(
+            "get_neighbors", predict_neighbors, receive_id, n_neighbors, input.nprobe, filters
+        )
 
+    neighbors_cache.put(cache_key, neighbors)
     return schemas.Predictions(neighbors=neighbors)
+
+
+@app.post('/user_event', response_model=schemas.UserEventResult)
+async def user_event(input: schemas.UserEvent):
+    if role == "shard":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Shard holds no user profiles, send events to the coordinator")
+    try:
+        embedding = (await run_in_executor("user_event", article_embeddings, [input.article_id]))[0]
+    except KeyError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown article {input.article_id}")
+    profile = profiles.push(input.user_id, input.article_id, embedding)
+    return schemas.UserEventResult(user_id=input.user_id, seen=len(profile.seen))
+
+
+@app.post('/get_coauthors', response_model=schemas.Predictions)
+async def get_coauthors(input: schemas.CoauthorsQuery):
+    if coauthors is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Co-author index is not loaded")
+    if input.id not in coauthors:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown author {input.id}")
+    cache_key = ("coauthors", input.id, input.k, input.exclude_coauthors, version)
+    cached = neighbors_cache.get(cache_key)
+    if cached is None:
+        cached = await run_in_executor(
+            "get_coauthors", recommend_coauthors, input.id, input.k, input.exclude_coauthors
+        )
+        neighbors_cache.put(cache_key, cached)
+    return schemas.Predictions(neighbors=cached)
+
+
+@app.post('/get_neighbors_batch', response_model=schemas.BatchPredictions)
+async def model_predict_batch(input: schemas.BatchReceiveId):
+    n_neighbors = 5
+    neighbors = [list(COLD_START_NEIGHBORS) for _ in input.users]
+    # одиночные статьи здесь идут через общий путь: среднее из одной статьи - это она сама
+    # пользователей с одинаковыми фильтрами считаем одним блочным умножением
+    groups = {}
+    for i, user in enumerate(input.users):
+        if user.id:
+            filters = schemas.Filters(**user.dict()).dict()
+            groups.setdefault(tuple(filters.items()), []).append(i)
+    for filters, users in groups.items():
+        if role == "coordinator":
+            group_neighbors = await search_shards([input.users[i].id for i in users], n_neighbors, None, dict(filters))
+        else:
+            group_neighbors = await run_in_executor(
+                "get_neighbors_batch", get_neighbors_for_users,
+                [input.users[i].id for i in users], n_neighbors, batch_block_size, dict(filters),
+            )
+        for i, user_neighbors in zip(users, group_neighbors):
+            neighbors[i] = user_neighbors
+    return schemas.BatchPredictions(predictions=[schemas.Predictions(neighbors=n) for n in neighbors])
+
+
+@app.post('/admin/embeddings', response_model=schemas.UpsertResult)
+def upsert_embeddings(input: schemas.EmbeddingsUpsert):
+    """
+    Adds or replaces embeddings of articles. Rows of the neighbor table listing a replaced article are searched
+    live, rows an upserted article would enter are searched live only for small tables (see NeighborTable.with_index)
+    """
+    global articles
+    if role == "coordinator":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Coordinator holds no embeddings, send upserts to shards")
+    if role == "shard":
+        foreign = [item.id for item in input.items if shard_of(item.id, num_shards) != shard_id]
+        if foreign:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"{len(foreign)} ids belong to other shards")
+    if executor.kind == "process":
+        # воркеры пула - форки со своей копией индекса, изменения до них не дойдут
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Upsert is not supported with EXECUTOR_KIND=process")
+    # если id повторяется, берем последний эмбеддинг
+    items = {item.id: item.embedding for item in input.items}
+    records = list({item.id: item.dict(include={"year", "venue", "tags"}) for item in input.items}.values())
+    if not items:
+        return schemas.UpsertResult(added=0, replaced=0, total=articles.index.n_live)
+    # проверяем до np.array: эмбеддинги разной длины не собираются в матрицу
+    if any(len(embedding) != articles.index.dim for embedding in items.values()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Every embedding must have {articles.index.dim} values")
+    vectors = np.array(list(items.values()), dtype=np.float32)
+    with upsert_lock:
+        replaced = sum(article_id in articles.index.id_to_row for article_id in items)
+        articles = articles.upsert(list(items.keys()), vectors, records)
+        neighbors_cache.clear()
+    logger.info(f"Upserted {len(items)} embeddings, {replaced} replaced, {articles.index.n_live} articles")
+    return schemas.UpsertResult(added=len(items) - replaced, replaced=replaced, total=articles.index.n_live)
+
+
+@app.post('/shard/search', response_model=List[schemas.ShardResult])
+async def shard_search(input: schemas.ShardQuery):
+    filters = schemas.Filters(**input.dict()).dict()
+    results = await run_in_executor(
+        "shard_search", search_shard, input.vectors, input.excludes, input.k, input.nprobe, filters
+    )
+    return [schemas.ShardResult(ids=ids.tolist(), distances=dist.tolist()) for ids, dist in results]
@@ -0,0 +1,141 @@
+"""
+Precomputed top-K neighbors of every article, the single-article recommendation becomes one row lookup.
+
+<table>/indices.npy     int32 rows of the embeddings store of shape (n, K), -1 pads missing neighbors
+<table>/distances.npy   float16 cosine distances of shape (n, K)
+
+Offline build after the embeddings store is ready:
+    python -m app.neighbor_table build app/models/articles_store app/models/neighbor_table --k 50
+"""
+import os
+import argparse
+import logging
+from typing import List, Optional
+
+import numpy as np
+from numpy import ndarray
+
+from app.index import EmbeddingIndex
+from app.store import open_store
+
+logger = logging.getLogger("logging_service")
+
+INDICES_FILE = "indices.npy"
+DISTANCES_FILE = "distances.npy"
+# предел строк таблицы * upsert-статей, до которого upsert ищет строки, куда попадут новые статьи
+RESCAN_LIMIT = 1 << 22
+
+
+class NeighborTable:
+    """
+    @index: index of articles the table was built for, rows of the table are rows of the index
+    @indices: int32 ndarray of shape (len(index), K)
+    @distances: float16 ndarray of shape (len(index), K)
+    """
+
+    def __init__(self, index: EmbeddingIndex, indices: ndarray, distances: ndarray):
+        if len(indices) != len(index):
+            raise ValueError(f"Neighbor table has {len(indices)} rows, index has {len(index)}")
+        self.index = index
+        self.indices = indices
+        self.distances = distances
+        # строки, которые устарели после upsert и ищутся вживую, None - таких нет
+        self.stale: Optional[ndarray] = None
+
+    @property
+    def k(self) -> int:
+        return self.indices.shape[1]
+
+    def with_index(self, index: EmbeddingIndex, rows: ndarray, block_size: int = 65536,
+                   rescan_limit: int = RESCAN_LIMIT) -> "NeighborTable":
+        """
+        Same table for a newer snapshot of the index. Upserted articles are not in the table.
+        Rows which list an article replaced by this upsert are marked stale and searched live, that costs
+        one pass over the int32 indices. Rows which an upserted article would enter are found by scoring
+        the whole table against the upserted vectors, O(rows * upserted * dim), so this is done only while
+        rows * upserted <= rescan_limit. Above the limit new articles reach the table after the offline build
+        @rows: rows of the upserted articles in the new index
+        """
+        table = NeighborTable.__new__(NeighborTable)
+        table.index, table.indices, table.distances = index, self.indices, self.distances
+        stale = np.zeros(len(self.indices), dtype=bool) if self.stale is None else self.stale.copy()
+        # строки, которые ссылались на прежние версии статей, проверены предыдущими upsert
+        replaced = np.setdiff1d(index.dead_rows, self.index.dead_rows, assume_unique=True)
+        if len(replaced):
+            stale |= np.isin(self.indices, replaced).any(axis=1)
+
+        if len(self.indices) * len(rows) <= rescan_limit:
+            upserted = index.vectors[rows]
+            # похожесть последнего соседа строки: новая статья ближе нее попадает в top-K
+            kth_similarity = 1. - self.distances[:, -1].astype(np.float32)
+            # дистанции хранятся во float16, поэтому сравниваем с запасом в сторону устаревания
+            kth_similarity[self.indices[:, -1] < 0] = -np.inf
+            kth_similarity -= 1e-3
+            for start in range(0, len(self.indices), block_size):
+                block = slice(start, min(start + block_size, len(self.indices)))
+                scores = index.vectors[block] @ upserted.T
+                stale[block] |= scores.max(axis=1) > kth_similarity[block]
+        else:
+            logger.info(f"Neighbor table: {len(rows)} upserted articles enter table rows after the offline build")
+        table.stale = stale
+        logger.info(f"Neighbor table: {int(stale.sum())}/{len(stale)} rows are searched live after upsert")
+        return table
+
+    @classmethod
+    def build(cls, index: EmbeddingIndex, k: int, block_size: int = 2048) -> "NeighborTable":
+        indices = np.full((len(index), k), -1, dtype=np.int32)
+        distances = np.ones((len(index), k), dtype=np.float16)
+        for start in range(0, len(index), block_size):
+            rows = np.arange(start, min(start + block_size, len(index)))
+            scores, best = index.search_batch_rows(
+                index.vectors[rows], k, [[article_id] for article_id in index.ids[rows].tolist()], block_size
+            )
+            found = np.isfinite(scores)
+            indices[rows, :best.shape[1]] = np.where(found, best, -1)
+            distances[rows, :best.shape[1]] = np.where(found, 1. - scores, 1.)
+            logger.info(f"Neighbor table: {rows[-1] + 1}/{len(index)} articles")
+        return cls(index, indices, distances)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, INDICES_FILE), self.indices)
+        np.save(os.path.join(path, DISTANCES_FILE), self.distances)
+
+    @classmethod
+    def load(cls, index: EmbeddingIndex, path: str) -> "NeighborTable":
+        return cls(
+            index,
+            np.load(os.path.join(path, INDICES_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, DISTANCES_FILE), mmap_mode="r"),
+        )
+
+    def lookup(self, article_id: str, k: int) -> Optional[List[str]]:
+        """
+        return: k nearest neighbors of the article or None if the article is unknown,
+                its row is stale or the table holds less than k neighbors
+        """
+        row = self.index.id_to_row.get(article_id)
+        if row is None or row >= len(self.indices) or k > self.k:
+            return None
+        if self.stale is not None and self.stale[row]:
+            return None
+        rows = self.indices[row, :k]
+        return self.index.ids[rows[rows >= 0]].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("store", help="directory of the embeddings store")
+    parser.add_argument("output", help="directory of the neighbor table")
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--block-size", type=int, default=2048)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    index = EmbeddingIndex(*open_store(args.store), normalized=True)
+    NeighborTable.build(index, args.k, args.block_size).save(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from typing import List, Optional, Set
+
+import numpy as np
+from numpy import ndarray
+
+from app.cache import LRUCache
+
+
+class UserProfile:
+    """
+    Running decay-weighted sum of embeddings of articles opened by a user.
+    Weight of an article is decay ** (number of articles opened after it), so one more article
+    changes the profile in O(dim): total = decay * total + embedding, weight = decay * weight + 1
+    @total: weighted sum of embeddings
+    @weight: sum of weights
+    @seen: ids of opened articles, they are not recommended
+    @version: changes on every update, part of the result cache key
+    """
+
+    def __init__(self, total: ndarray, weight: float, seen: Set[str], version: int):
+        self.total = total
+        self.weight = weight
+        self.seen = seen
+        self.version = version
+
+    @property
+    def vector(self) -> ndarray:
+        return self.total / self.weight
+
+
+class ProfileStore:
+    """
+    Profiles of recently active users, least recently used profiles are evicted first.
+    Profiles are changed only from the event loop, so readers never see a half-updated profile
+    @maxsize: max number of profiles held in memory
+    @decay: weight multiplier of older articles per newer article, in (0, 1]
+    """
+
+    def __init__(self, maxsize: int, decay: float = 0.9):
+        if not 0. < decay <= 1.:
+            raise ValueError(f"Profile decay must be in (0, 1], got {decay}")
+        self.decay = decay
+        self.profiles = LRUCache(maxsize)
+        self._version = 0
+
+    def _next_version(self) -> int:
+        self._version += 1
+        return self._version
+
+    def get(self, user_id: str) -> Optional[UserProfile]:
+        return self.profiles.get(user_id)
+
+    def build(self, user_id: str, history: List[str], embeddings: ndarray) -> UserProfile:
+        """
+        Creates the profile of a user who has no profile yet from the whole history
+        @history: ids of opened articles from the oldest to the newest
+        @embeddings: ndarray of shape (len(history), dim)
+        """
+        weights = self.decay ** np.arange(len(history) - 1, -1, -1, dtype=np.float64)
+        profile = UserProfile(
+            (weights @ np.asarray(embeddings, dtype=np.float64)).astype(np.float32),
+            float(weights.sum()), set(history), self._next_version(),
+        )
+        self.profiles.put(user_id, profile)
+        return profile
+
+    def push(self, user_id: str, article_id: str, embedding: ndarray) -> UserProfile:
+        """
+        Adds one newly opened article to the profile, the profile is created if the user has none
+        """
+        profile = self.profiles.get(user_id)
+        if profile is None:
+            return self.build(user_id, [article_id], np.asarray(embedding)[None])
+        # новый массив, а не +=, чтобы запросы с прежним вектором его не увидели частично измененным
+        profile.total = (self.decay * profile.total + embedding).astype(np.float32)
+        profile.weight = self.decay * profile.weight + 1.
+        profile.seen.add(article_id)
+        profile.version = self._next_version()
+        self.profiles.put(user_id, profile)
+        return profile
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+    def stats(self) -> dict:
+        return dict(self.profiles.stats(), decay=self.decay)
@@ -0,0 +1,252 @@
+import os
+import logging
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from app.index import EmbeddingIndex, grow, normalize_rows, top_k
+
+logger = logging.getLogger("logging_service")
+
+SCORE_BLOCK_SIZE = 65536
+# число подвекторов PQ по умолчанию, должно делить размер эмбеддингов (100)
+PQ_M = 10
+
+
+def kmeans(vectors: ndarray, n_clusters: int, n_iter: int = 15, seed: int = 0) -> ndarray:
+    """
+    Euclidean k-means, used to train product quantization codebooks
+    return: centroids of shape (n_clusters, dim)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = nearest_centroid(vectors, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        empty = counts == 0
+        sums = np.add.reduceat(vectors[np.argsort(assignments, kind="stable")], starts[~empty], axis=0)
+        centroids[~empty] = sums / counts[~empty, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def nearest_centroid(vectors: ndarray, centroids: ndarray) -> ndarray:
+    distances = (centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T
+    return np.argmin(distances, axis=1)
+
+
+class Float16Codec:
+    """
+    Half precision copy of normalized embeddings, 2x smaller than float32
+    """
+    name = "float16"
+
+    def train(self, vectors: ndarray):
+        pass
+
+    def encode(self, vectors: ndarray) -> ndarray:
+        return np.asarray(vectors).astype(np.float16)
+
+    def scores(self, codes: ndarray, query: ndarray) -> ndarray:
+        return codes.astype(np.float32) @ query
+
+    def state(self) -> dict:
+        return {}
+
+    def load_state(self, state: dict):
+        pass
+
+
+class Int8Codec:
+    """
+    Scalar quantization: every dimension is mapped linearly from [min, max] to 256 levels, 4x smaller than float32
+    """
+    name = "int8"
+
+    def __init__(self):
+        self.low = None
+        self.step = None
+
+    def train(self, vectors: ndarray):
+        self.low = vectors.min(axis=0).astype(np.float32)
+        high = vectors.max(axis=0).astype(np.float32)
+        self.step = np.maximum(high - self.low, 1e-12) / 255.
+
+    def encode(self, vectors: ndarray) -> ndarray:
+        levels = np.rint((np.asarray(vectors, dtype=np.float32) - self.low) / self.step)
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def scores(self, codes: ndarray, query: ndarray) -> ndarray:
+        # x ~ (code + 128) * step + low, поэтому x @ q = code @ (step * q) + (128 * step + low) @ q
+        return codes.astype(np.float32) @ (self.step * query) + (128 * self.step + self.low) @ query
+
+    def state(self) -> dict:
+        return {"low": self.low, "step": self.step}
+
+    def load_state(self, state: dict):
+        self.low, self.step = state["low"], state["step"]
+
+
+class PQCodec:
+    """
+    Product quantization: embedding is split into m subvectors, every subvector is replaced
+    with the id of the closest of 256 centroids, so one article takes m bytes
+    """
+    name = "pq"
+
+    def __init__(self, m: int = PQ_M, train_size: int = 65536, seed: int = 0):
+        self.m = m
+        self.train_size = train_size
+        self.seed = seed
+        self.codebooks = None
+
+    def _split(self, vectors: ndarray) -> ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[-1] % self.m:
+            raise ValueError(f"Embedding size {vectors.shape[-1]} is not divisible by pq m={self.m}")
+        return vectors.reshape(*vectors.shape[:-1], self.m, vectors.shape[-1] // self.m)
+
+    def train(self, vectors: ndarray):
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(len(vectors), min(len(vectors), self.train_size), replace=False))
+        subvectors = self._split(vectors[sample])
+        self.codebooks = np.stack([
+            kmeans(subvectors[:, j], min(256, len(sample)), seed=self.seed + j) for j in range(self.m)
+        ])
+
+    def encode(self, vectors: ndarray) -> ndarray:
+        subvectors = self._split(vectors)
+        return np.stack([
+            nearest_centroid(subvectors[:, j], self.codebooks[j]) for j in range(self.m)
+        ], axis=1).astype(np.uint8)
+
+    def scores(self, codes: ndarray, query: ndarray) -> ndarray:
+        # таблица скалярных произведений подвекторов запроса со всеми центроидами, дальше только сложение
+        table = np.einsum("jcd,jd->jc", self.codebooks, self._split(query))
+        return table[np.arange(self.m), codes].sum(axis=1)
+
+    def state(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+    def load_state(self, state: dict):
+        self.codebooks = state["codebooks"]
+        self.m = len(self.codebooks)
+
+
+def make_codec(kind: str, pq_m: int = PQ_M):
+    if kind == "float16":
+        return Float16Codec()
+    if kind == "int8":
+        return Int8Codec()
+    if kind == "pq":
+        return PQCodec(pq_m)
+    raise ValueError(f"Unknown quantization {kind}")
+
+
+class QuantizedIndex:
+    """
+    Cosine search over compressed embeddings with optional exact re-rank of the best candidates.
+    Full precision vectors of the base index are read only for re-ranked rows,
+    so with the memory-mapped store they mostly stay on disk
+    @base: exact index which holds ids and full precision vectors
+    @codec: Float16Codec, Int8Codec or PQCodec
+    @codes: compressed embeddings, codes[i] encodes the i-th row of base
+    @rerank: number of candidates re-ranked with full precision vectors, 0 disables re-rank
+    """
+
+    def __init__(self, base: EmbeddingIndex, codec, codes: Optional[ndarray] = None, rerank: int = 0):
+        self.base = base
+        self.codec = codec
+        self.rerank = rerank
+        if codes is None:
+            codec.train(base.vectors)
+            codes = np.concatenate([
+                codec.encode(base.vectors[start:start + SCORE_BLOCK_SIZE])
+                for start in range(0, len(base), SCORE_BLOCK_SIZE)
+            ])
+        self._codes = codes
+
+    @property
+    def codes(self) -> ndarray:
+        return self._codes[:len(self.base)]
+
+    def upsert(self, base: EmbeddingIndex, rows: ndarray) -> "QuantizedIndex":
+        """
+        @base: new snapshot of the base index
+        @rows: rows of base added by upsert, they are encoded with the trained codec
+        return: new snapshot of the quantized index
+        """
+        codes = grow(self._codes, len(self.base), len(rows))
+        codes[rows] = self.codec.encode(base.vectors[rows])
+        return QuantizedIndex(base, self.codec, codes, self.rerank)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(f, kind=self.codec.name, codes=self.codes, **self.codec.state())
+
+    @classmethod
+    def load(cls, base: EmbeddingIndex, path: str, rerank: int = 0) -> "QuantizedIndex":
+        with np.load(path) as data:
+            if len(data["codes"]) != len(base):
+                raise ValueError(f"Codes {path} were built for {len(data['codes'])} rows, got {len(base)}")
+            codec = make_codec(str(data["kind"]))
+            codec.load_state({key: data[key] for key in data.files if key not in ("kind", "codes")})
+            return cls(base, codec, data["codes"], rerank)
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + sum(value.nbytes for value in self.codec.state().values())
+
+    def scores(self, query: ndarray) -> ndarray:
+        """
+        return: approximate cosine similarity between normalized query and every row
+        """
+        return np.concatenate([
+            self.codec.scores(self.codes[start:start + SCORE_BLOCK_SIZE], query)
+            for start in range(0, len(self.codes), SCORE_BLOCK_SIZE)
+        ]).astype(np.float32)
+
+    def search(self, query: ndarray, k: int, exclude: Iterable[str] = (), mask: Optional[ndarray] = None,
+               rerank: Optional[int] = None, **params) -> Tuple[ndarray, ndarray]:
+        """
+        @mask: bool ndarray over rows of base, only rows where it is True may be returned
+        @rerank: overrides the number of re-ranked candidates for this request
+        return: (ids, dist) of k nearest neighbors sorted by cosine distance
+        """
+        query = normalize_rows(query)
+        scores = self.scores(query)
+        scores[self.base.excluded_rows(exclude)] = -np.inf
+        if mask is not None:
+            scores[~mask] = -np.inf
+        rerank = self.rerank if rerank is None else rerank
+        if rerank <= 0:
+            best = top_k(scores, k)
+            return self.base.ids[best], 1. - scores[best]
+        candidates = np.sort(top_k(scores, max(rerank, k)))
+        exact = self.base.vectors[candidates] @ query
+        best = top_k(exact, k)
+        return self.base.ids[candidates[best]], 1. - exact[best]
+
+
+def make_quantized_index(base: EmbeddingIndex, kind: str, path: Optional[str] = None,
+                         rerank: int = 0, pq_m: int = PQ_M):
+    """
+    @kind: "none", "float16", "int8" or "pq"
+    @path: file of precomputed codes, codes are computed and saved there if the file is missing
+    return: base for "none", otherwise QuantizedIndex
+    """
+    if kind == "none":
+        return base
+    if path is not None and os.path.exists(path):
+        logger.info(f"Loading {kind} codes from {path}")
+        return QuantizedIndex.load(base, path, rerank)
+    logger.info(f"Quantizing {len(base)} articles with {kind}")
+    index = QuantizedIndex(base, make_codec(kind, pq_m), rerank=rerank)
+    if path is not None:
+        index.save(path)
+    return index
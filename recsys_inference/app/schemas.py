@@ -1,10 +1,74 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
-class ReceiveId(BaseModel):
+class Filters(BaseModel):
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    venue: Optional[str] = None
+    tag: Optional[str] = None
+
+
+class ReceiveId(Filters):
     id: List[str]
+    nprobe: Optional[int] = None  # число просматриваемых кластеров ivf индекса, больше - точнее и медленнее
+    # если задан, рекомендации строятся по профилю пользователя, id нужен только для создания профиля
+    user_id: Optional[str] = None
 
 
 class Predictions(BaseModel):
     neighbors: List[str]
+
+
+class BatchReceiveId(BaseModel):
+    users: List[ReceiveId]
+
+
+class BatchPredictions(BaseModel):
+    predictions: List[Predictions]
+
+
+class ArticleEmbedding(BaseModel):
+    id: str
+    embedding: List[float]
+    year: Optional[int] = None
+    venue: Optional[str] = None
+    tags: List[str] = []
+
+
+class EmbeddingsUpsert(BaseModel):
+    items: List[ArticleEmbedding]
+
+
+class UpsertResult(BaseModel):
+    added: int
+    replaced: int
+    total: int
+
+
+class UserEvent(BaseModel):
+    user_id: str
+    article_id: str
+
+
+class UserEventResult(BaseModel):
+    user_id: str
+    seen: int
+
+
+class CoauthorsQuery(BaseModel):
+    id: str
+    k: int = 5
+    exclude_coauthors: bool = True  # не рекомендовать тех, с кем автор уже писал статьи
+
+
+class ShardQuery(Filters):
+    vectors: List[List[float]]
+    excludes: List[List[str]]
+    k: int
+    nprobe: Optional[int] = None
+
+
+class ShardResult(BaseModel):
+    ids: List[str]
+    distances: List[float]
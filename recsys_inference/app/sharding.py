@@ -0,0 +1,124 @@
+"""
+Scatter-gather mode for corpora which do not fit one node.
+
+RECSYS_ROLE=shard        loads only its hash partition of the embeddings store (SHARD_ID of NUM_SHARDS)
+                         and answers POST /shard/search
+RECSYS_ROLE=coordinator  loads only the graph model, computes user vectors and fans them out to SHARD_URLS,
+                         partial top-k lists of shards are merged into the answer
+
+Local run with several processes (store and model must be available locally):
+    PYTHONPATH=.. python -m app.sharding launch --shards 3 --port 8090
+"""
+import os
+import sys
+import zlib
+import signal
+import asyncio
+import argparse
+import subprocess
+from typing import List, Optional, Tuple
+
+import httpx
+import numpy as np
+from numpy import ndarray
+
+from app import schemas
+
+
+def shard_of(article_id: str, num_shards: int) -> int:
+    # crc32 одинаков во всех процессах, в отличие от hash() со случайной солью
+    return zlib.crc32(article_id.encode()) % num_shards
+
+
+def partition_rows(ids: ndarray, shard_id: int, num_shards: int) -> ndarray:
+    """
+    return: rows of ids which belong to the shard
+    """
+    shards = np.fromiter((shard_of(article_id, num_shards) for article_id in ids.tolist()),
+                         dtype=np.int64, count=len(ids))
+    return np.flatnonzero(shards == shard_id)
+
+
+def merge_top_k(results: List[schemas.ShardResult], k: int) -> List[str]:
+    """
+    @results: partial top-k lists of all shards for one query
+    return: ids of k nearest neighbors over all shards
+    """
+    ids = [article_id for result in results for article_id in result.ids]
+    distances = np.array([dist for result in results for dist in result.distances])
+    return [ids[i] for i in np.argsort(distances, kind="stable")[:k]]
+
+
+class ShardClient:
+    """
+    Fans out queries to all shards in parallel and merges their answers
+    @urls: base urls of shards, for example http://recsys_shard_0:8080
+    @timeout: timeout of one shard request in seconds
+    """
+
+    def __init__(self, urls: List[str], timeout: float = 5.):
+        self.urls = urls
+        self.client = httpx.AsyncClient(timeout=timeout)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _query(self, url: str, query: schemas.ShardQuery) -> List[schemas.ShardResult]:
+        response = await self.client.post(f"{url}/shard/search", json=query.dict())
+        response.raise_for_status()
+        return [schemas.ShardResult(**result) for result in response.json()]
+
+    async def search(self, vectors: ndarray, k: int, excludes: List[List[str]], nprobe: Optional[int] = None,
+                     filters: Optional[dict] = None) -> List[List[str]]:
+        """
+        @vectors: ndarray of shape (n_queries, dim)
+        return: ids of k nearest neighbors over all shards for every query
+        """
+        query = schemas.ShardQuery(
+            vectors=np.asarray(vectors, dtype=np.float32).tolist(), excludes=excludes, k=k, nprobe=nprobe,
+            **(filters or {}),
+        )
+        answers = await asyncio.gather(*[self._query(url, query) for url in self.urls])
+        return [merge_top_k([answer[i] for answer in answers], k) for i in range(len(vectors))]
+
+
+def launch(num_shards: int, port: int, env: dict) -> Tuple[List[subprocess.Popen], str]:
+    """
+    Starts num_shards shard processes on ports port + 1 ... and a coordinator on port
+    return: (processes, url of the coordinator)
+    """
+    processes = []
+    urls = []
+    for shard_id in range(num_shards):
+        shard_port = port + 1 + shard_id
+        shard_env = dict(env, RECSYS_ROLE="shard", SHARD_ID=str(shard_id), NUM_SHARDS=str(num_shards))
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(shard_port)], env=shard_env,
+        ))
+        urls.append(f"http://127.0.0.1:{shard_port}")
+    coordinator_env = dict(env, RECSYS_ROLE="coordinator", SHARD_URLS=",".join(urls))
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)], env=coordinator_env,
+    ))
+    return processes, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["launch"])
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+
+    processes, url = launch(args.shards, args.port, dict(os.environ))
+    print(f"Coordinator: {url}, shards: {args.shards}")
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.send_signal(signal.SIGINT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+On-disk format of articles embeddings which is opened with np.memmap, so page cache is shared by all workers.
+
+<store>/header.json   {"format": ..., "version": ..., "count": n, "dim": d, "dtype": "float32", "normalized": true}
+<store>/vectors.f32   normalized float32 matrix of shape (n, d) in C order
+<store>/ids.npy       fixed width unicode array of n article ids
+
+Conversion from the pickled dict (ARTICLE_EMBED):
+    python -m app.store convert app/models/articles_embeddings.npy app/models/articles_store
+"""
+import os
+import sys
+import json
+import shutil
+import logging
+from typing import Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from app.index import normalize_rows
+
+logger = logging.getLogger("logging_service")
+
+STORE_FORMAT = "citation-network-embeddings"
+STORE_VERSION = 1
+HEADER_FILE = "header.json"
+VECTORS_FILE = "vectors.f32"
+IDS_FILE = "ids.npy"
+
+
+def store_exists(path: str) -> bool:
+    return os.path.exists(os.path.join(path, HEADER_FILE))
+
+
+def read_header(path: str) -> dict:
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        header = json.load(f)
+    if header.get("format") != STORE_FORMAT or header.get("version") != STORE_VERSION:
+        raise ValueError(f"{path} is not an embeddings store of version {STORE_VERSION}")
+    return header
+
+
+def open_store(path: str) -> Tuple[ndarray, ndarray]:
+    """
+    @path: directory of the store
+    return: (ids, vectors) where vectors is a read-only np.memmap of normalized embeddings
+    """
+    header = read_header(path)
+    ids = np.load(os.path.join(path, IDS_FILE), mmap_mode="r")
+    vectors = np.memmap(
+        os.path.join(path, VECTORS_FILE), dtype=header["dtype"], mode="r",
+        shape=(header["count"], header["dim"]),
+    )
+    if len(ids) != header["count"]:
+        raise ValueError(f"{path}: header has {header['count']} rows, id table has {len(ids)}")
+    return ids, vectors
+
+
+def write_store(path: str, ids, vectors, chunk_size: int = 65536):
+    """
+    Writes store atomically: files are written into a temporary directory which is renamed to path,
+    so concurrently starting workers never see a half written store
+    @ids: article ids
+    @vectors: sequence of embeddings (ndarray or any sequence of rows), normalized on write
+    """
+    ids = np.asarray(ids, dtype=str)
+    count, dim = len(ids), len(vectors[0])
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    matrix = np.memmap(os.path.join(tmp_path, VECTORS_FILE), dtype=np.float32, mode="w+", shape=(count, dim))
+    for start in range(0, count, chunk_size):
+        matrix[start:start + chunk_size] = normalize_rows(np.stack(vectors[start:start + chunk_size]))
+    matrix.flush()
+    del matrix
+    np.save(os.path.join(tmp_path, IDS_FILE), ids)
+    header = {
+        "format": STORE_FORMAT,
+        "version": STORE_VERSION,
+        "count": count,
+        "dim": dim,
+        "dtype": "float32",
+        "normalized": True,
+    }
+    with open(os.path.join(tmp_path, HEADER_FILE), "w") as f:
+        json.dump(header, f)
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # другой воркер успел сконвертировать раньше
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not store_exists(path):
+            raise
+
+
+def convert_npy(npy_path: str, path: str):
+    """
+    One-time conversion of the pickled {id: embedding} dict into the store
+    """
+    with open(npy_path, "rb") as f:
+        embeddings = np.load(f, allow_pickle=True).item()
+    write_store(path, list(embeddings.keys()), list(embeddings.values()))
+    logger.info(f"Converted {len(embeddings)} embeddings from {npy_path} to {path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "convert":
+        print(__doc__)
+        sys.exit(1)
+    convert_npy(sys.argv[2], sys.argv[3])
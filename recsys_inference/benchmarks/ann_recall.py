@@ -0,0 +1,60 @@
+"""
+Offline recall@k of the ivf index against exact search.
+Run from recsys_inference directory:
+    python -m benchmarks.ann_recall --embeddings app/models/articles_embeddings.npy --nlist 1024
+Without --embeddings a synthetic clustered corpus is used.
+"""
+import argparse
+
+import numpy as np
+
+from app.ann import IVFIndex
+from app.index import EmbeddingIndex
+from benchmarks.common import measure, summary, synthetic_corpus
+
+
+def clustered_corpus(n: int, dim: int, n_topics: int = 500, seed: int = 0):
+    # реальные эмбеддинги статей сгруппированы по темам, гауссов шум без структуры дает заниженный recall
+    ids, noise = synthetic_corpus(n, dim, seed)
+    rng = np.random.default_rng(seed + 1)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    return ids, topics[rng.integers(n_topics, size=n)] + noise
+
+
+def recall_at_k(exact_ids, approx_ids, k: int) -> float:
+    return float(np.mean([len(set(e[:k]) & set(a[:k])) / k for e, a in zip(exact_ids, approx_ids)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings", help="articles embeddings in the format of ARTICLE_EMBED")
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--history", type=int, default=3, help="number of articles averaged into a query")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        with open(args.embeddings, "rb") as f:
+            index = EmbeddingIndex.from_dict(np.load(f, allow_pickle=True).item())
+    else:
+        index = EmbeddingIndex(*clustered_corpus(args.size, args.dim))
+    ivf = IVFIndex.build(index, args.nlist)
+
+    rng = np.random.default_rng(2)
+    # запросы как у пользователя с историей из нескольких статей
+    histories = [rng.integers(len(index), size=args.history) for _ in range(args.queries)]
+    queries = [(index.ids[rows].tolist(), index.vectors[rows].mean(axis=0)) for rows in histories]
+    exact = [index.search(q, args.k, exclude=seen)[0] for seen, q in queries]
+    print(f"n={len(index)} nlist={ivf.nlist} exact: {summary(measure(lambda q: index.search(q[1], args.k, q[0]), queries))}")
+    for nprobe in args.nprobe:
+        approx = [ivf.search(q, args.k, exclude=seen, nprobe=nprobe)[0] for seen, q in queries]
+        latency = summary(measure(lambda q: ivf.search(q[1], args.k, q[0], nprobe=nprobe), queries))
+        print(f"nprobe={nprobe:>4} recall@{args.k}={recall_at_k(exact, approx, args.k):.3f} {latency}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Memory saved and recall lost by every quantization mode compared to the exact float32 search.
+Run from recsys_inference directory:
+    python -m benchmarks.bench_quantization --size 1000000 --rerank 0 100
+"""
+import argparse
+
+import numpy as np
+
+from app.index import EmbeddingIndex
+from app.quantization import PQ_M, QuantizedIndex, make_codec
+from benchmarks.ann_recall import clustered_corpus, recall_at_k
+from benchmarks.common import measure, summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings", help="articles embeddings in the format of ARTICLE_EMBED")
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument("--modes", nargs="+", default=["float16", "int8", "pq"])
+    parser.add_argument("--pq-m", type=int, default=PQ_M)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 100])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        with open(args.embeddings, "rb") as f:
+            index = EmbeddingIndex.from_dict(np.load(f, allow_pickle=True).item())
+    else:
+        index = EmbeddingIndex(*clustered_corpus(args.size, args.dim))
+
+    rng = np.random.default_rng(2)
+    histories = [rng.integers(len(index), size=3) for _ in range(args.queries)]
+    queries = [(index.ids[rows].tolist(), index.vectors[rows].mean(axis=0)) for rows in histories]
+    exact = [index.search(q, args.k, exclude=seen)[0] for seen, q in queries]
+    base_bytes = index.vectors.nbytes
+    latency = summary(measure(lambda q: index.search(q[1], args.k, q[0]), queries))
+    print(f"n={len(index)} float32: {base_bytes / 2 ** 20:.1f} MiB {latency}")
+
+    for mode in args.modes:
+        quantized = QuantizedIndex(index, make_codec(mode, args.pq_m))
+        saved = 1. - quantized.nbytes / base_bytes
+        for rerank in args.rerank:
+            approx = [quantized.search(q, args.k, exclude=seen, rerank=rerank)[0] for seen, q in queries]
+            recall = recall_at_k(exact, approx, args.k)
+            latency = summary(measure(lambda q: quantized.search(q[1], args.k, q[0], rerank=rerank), queries))
+            print(f"{mode:>8} rerank={rerank:>4}: {quantized.nbytes / 2 ** 20:.1f} MiB (saved {saved:.1%}) "
+                  f"recall@{args.k}={recall:.3f} {latency}")
+
+
+if __name__ == "__main__":
+    main()
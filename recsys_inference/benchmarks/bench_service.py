@@ -0,0 +1,222 @@
+"""
+Latency and throughput of the recommendation paths of the service on synthetic corpora.
+The ampligraph model is replaced with a stub which returns embeddings of the store, startup events are not run:
+the benchmark sets the globals of app.main itself, so nothing is downloaded.
+
+Every path (single article, multi-article history, cold start) is measured
+    inprocess - the /get_neighbors handler is awaited directly, without HTTP
+    asgi      - requests go through the FastAPI app with an in-process ASGI client
+Run from recsys_inference directory, the shared common package is in the root of the repository:
+    PYTHONPATH=.. python -m benchmarks.bench_service --sizes 10000 100000 1000000 --output results.json
+    PYTHONPATH=.. python -m benchmarks.bench_service --sizes 10000 --baseline results.json
+Stores of synthetic corpora are kept in --workdir and reused by later runs.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+from typing import List
+
+import httpx
+import numpy as np
+from numpy import ndarray
+
+from app import main as service
+from app import schemas
+from app.ann import make_search_index
+from app.articles import Articles
+from app.cache import LRUCache
+from app.executor import BoundedExecutor
+from app.index import EmbeddingIndex
+from app.quantization import make_quantized_index
+from app.store import open_store, store_exists, write_store
+from benchmarks.common import measure_async, summary, throughput
+
+PATHS = ["single", "multi", "cold"]
+MODES = ["inprocess", "asgi"]
+CHUNK_SIZE = 65536
+
+
+class SyntheticVectors:
+    """
+    Gaussian embeddings generated chunk by chunk, so a corpus of millions of rows is written
+    to the store without holding the whole matrix in memory
+    """
+
+    def __init__(self, n: int, dim: int, seed: int = 0):
+        self.n = n
+        self.dim = dim
+        self.seed = seed
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _chunk(self, chunk: int) -> ndarray:
+        rng = np.random.default_rng([self.seed, chunk])
+        size = min(CHUNK_SIZE, self.n - chunk * CHUNK_SIZE)
+        return rng.standard_normal((size, self.dim), dtype=np.float32)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, _ = item.indices(self.n)
+            if start % CHUNK_SIZE or (stop - start > CHUNK_SIZE):
+                raise IndexError("Only slices of one chunk are supported")
+            return self._chunk(start // CHUNK_SIZE)[:stop - start]
+        return self._chunk(item // CHUNK_SIZE)[item % CHUNK_SIZE]
+
+
+class StubModel:
+    """
+    Stands in for the ampligraph model: embeddings of articles are rows of the store
+    """
+
+    def __init__(self, index: EmbeddingIndex):
+        self.index = index
+        self.ent_to_idx = index.id_to_row
+
+    def get_embeddings(self, entities: List[str]) -> ndarray:
+        return self.index.vectors[self.index.rows(entities)]
+
+
+def synthetic_store(workdir: str, n: int, dim: int) -> str:
+    path = os.path.join(workdir, f"store-{n}x{dim}")
+    if not store_exists(path):
+        print(f"Writing synthetic store {path}")
+        os.makedirs(workdir, exist_ok=True)
+        write_store(path, [f"{i:024x}" for i in range(n)], SyntheticVectors(n, dim), chunk_size=CHUNK_SIZE)
+    return path
+
+
+def make_articles(store_path: str, kind: str, nlist: int, nprobe: int) -> Articles:
+    index = EmbeddingIndex(*open_store(store_path), normalized=True)
+    if kind in ("float16", "int8", "pq"):
+        search = make_quantized_index(index, kind)
+    else:
+        search = make_search_index(index, kind, nlist=nlist, nprobe=nprobe)
+    return Articles(index, search)
+
+
+def make_queries(index: EmbeddingIndex, n_queries: int, history: int, seed: int = 1) -> dict:
+    rng = np.random.default_rng(seed)
+    return {
+        "single": [[article_id] for article_id in index.ids[rng.integers(len(index), size=n_queries)].tolist()],
+        "multi": [index.ids[rng.integers(len(index), size=history)].tolist() for _ in range(n_queries)],
+        "cold": [[] for _ in range(n_queries)],
+    }
+
+
+async def run_mode(mode: str, queries: dict, args) -> List[dict]:
+    if mode == "inprocess":
+        async def request(receive_id):
+            return await service.model_predict(schemas.ReceiveId(id=receive_id))
+        client = None
+    else:
+        client = httpx.AsyncClient(app=service.app, base_url="http://bench")
+
+        async def request(receive_id):
+            response = await client.post("/get_neighbors", json={"id": receive_id})
+            response.raise_for_status()
+            return response.json()
+
+    results = []
+    try:
+        for path in args.paths:
+            await measure_async(request, queries[path][:args.warmup])
+            latency = summary(await measure_async(request, queries[path]))
+            latency["qps_concurrent"] = await throughput(request, queries[path], args.concurrency)
+            results.append(dict(mode=mode, path=path, **latency))
+            print(f"  {mode:>9} {path:>6}: p50={latency['p50_ms']:.2f}ms p99={latency['p99_ms']:.2f}ms "
+                  f"qps={latency['qps']:.0f} qps@{args.concurrency}={latency['qps_concurrent']:.0f}")
+    finally:
+        if client is not None:
+            await client.aclose()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results: List[dict], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {(r["size"], r["mode"], r["path"]): r for r in json.load(f)["results"]}
+    print(f"Compared to {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["size"], result["mode"], result["path"]))
+        if old is None:
+            continue
+        print(f"  n={result['size']:>9} {result['mode']:>9} {result['path']:>6}: "
+              f"p50 {old['p50_ms']:.2f} -> {result['p50_ms']:.2f}ms, "
+              f"p99 {old['p99_ms']:.2f} -> {result['p99_ms']:.2f}ms, "
+              f"qps {old['qps']:.0f} -> {result['qps']:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="corpus sizes, up to 5000000")
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument("--index", default="exact", choices=["exact", "ivf", "float16", "int8", "pq"])
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--history", type=int, default=10, help="number of articles in a multi-article history")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight for qps_concurrent")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--paths", nargs="+", default=PATHS, choices=PATHS)
+    parser.add_argument("--workers", type=int, default=4, help="threads of the executor")
+    parser.add_argument("--cache", action="store_true", help="keep the result cache, it is disabled by default")
+    parser.add_argument("--workdir", default="benchmarks/data")
+    parser.add_argument("--output", help="json file for results")
+    parser.add_argument("--baseline", help="json file of a previous run to compare with")
+    args = parser.parse_args()
+
+    # очередь не должна отклонять запросы бенчмарка
+    service.executor = BoundedExecutor("thread", args.workers, max_queue=max(args.concurrency, args.workers) * 2)
+    service.executor.start()
+    if not args.cache:
+        service.neighbors_cache = LRUCache(maxsize=0)
+
+    results = []
+    for n in args.sizes:
+        start = time.perf_counter()
+        service.articles = make_articles(synthetic_store(args.workdir, n, args.dim), args.index,
+                                         args.nlist, args.nprobe)
+        service.model = StubModel(service.articles.index)
+        print(f"n={n} dim={args.dim} index={args.index}: loaded in {time.perf_counter() - start:.1f}s")
+        queries = make_queries(service.articles.index, args.queries, args.history)
+        for mode in args.modes:
+            for result in asyncio.run(run_mode(mode, queries, args)):
+                results.append(dict(size=n, **result))
+    service.executor.shutdown()
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Latency of nearest neighbors search for multi-article recommendations.
+Run from recsys_inference directory:
+    python -m benchmarks.bench_top_k --sizes 100000 1000000
+"""
+import argparse
+
+import numpy as np
+from scipy.spatial import distance
+
+from app.index import EmbeddingIndex
+from benchmarks.common import measure, summary, synthetic_corpus
+
+
+def legacy_find_nearest_neighbors(articles_embeddings, receive_id, k, mean_article):
+    # реализация find_nearest_neighbors до перехода на EmbeddingIndex
+    dict_dists = dict()
+    for key, val in articles_embeddings.items():
+        dict_dists[key] = distance.cosine(mean_article, val)
+    sorted_dict_dists = dict(sorted(dict_dists.items(), key=lambda kv: kv[1]))
+    list_keys = [key for key in sorted_dict_dists.keys() if key not in receive_id]
+    return list_keys[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--legacy-max-size", type=int, default=100_000,
+                        help="the python loop is measured only for corpora not larger than this")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    for n in args.sizes:
+        ids, vectors = synthetic_corpus(n, args.dim)
+        index = EmbeddingIndex(ids, vectors)
+        seen = [ids[rng.integers(n, size=5)].tolist() for _ in range(args.queries)]
+        queries = [(history, vectors[index.rows(history)].mean(axis=0)) for history in seen]
+
+        result = summary(measure(lambda q: index.search(q[1], args.k, exclude=q[0]), queries))
+        print(f"n={n:>9} dim={args.dim} vectorized: {result}")
+
+        if n <= args.legacy_max_size:
+            embeddings = dict(zip(ids.tolist(), vectors))
+            legacy = summary(measure(
+                lambda q: legacy_find_nearest_neighbors(embeddings, q[0], args.k, q[1]), queries[:5]
+            ))
+            print(f"n={n:>9} dim={args.dim} legacy loop: {legacy}")
+
+
+if __name__ == "__main__":
+    main()
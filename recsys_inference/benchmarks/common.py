@@ -0,0 +1,68 @@
+import asyncio
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+
+def synthetic_corpus(n: int, dim: int, seed: int = 0) -> Tuple[ndarray, ndarray]:
+    """
+    @n: number of articles
+    @dim: embedding size
+    return: (ids, vectors) where ids look like ids of the citation network dataset
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.array([f"{i:024x}" for i in range(n)])
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    return ids, vectors
+
+
+def measure(fn: Callable, queries: List, repeat: int = 1) -> ndarray:
+    """
+    return: latencies in milliseconds of fn called on every query
+    """
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def summary(latencies: ndarray) -> dict:
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "qps": float(1000. / latencies.mean()),
+    }
+
+
+async def measure_async(fn: Callable, queries: List, repeat: int = 1) -> ndarray:
+    """
+    return: latencies in milliseconds of coroutine fn awaited on every query one by one
+    """
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            await fn(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+async def throughput(fn: Callable, queries: List, concurrency: int) -> float:
+    """
+    return: queries per second of coroutine fn with concurrency requests in flight
+    """
+    queue = list(reversed(queries))
+
+    async def worker():
+        while queue:
+            await fn(queue.pop())
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return len(queries) / (time.perf_counter() - start)
@@ -0,0 +1,139 @@
+"""
+Scatter-gather on local processes: 2 shards and a coordinator over a small synthetic store
+must answer like the exact search over the whole store.
+
+The service processes get a stand-in of ampligraph written to tmp_path: the graph model is replaced
+with a pickled table of the same embeddings, so the test runs without tensorflow and a trained model.
+Run from recsys_inference directory:
+    PYTHONPATH=.. python -m pytest tests
+"""
+import os
+import math
+import time
+import pickle
+import socket
+import textwrap
+
+import httpx
+import numpy as np
+import pytest
+
+from app.index import EmbeddingIndex
+from app.sharding import launch
+from app.store import write_store
+
+RECSYS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(RECSYS_DIR)
+# /get_neighbors всегда отдает 5 соседей
+N_ARTICLES, DIM, K = 3000, 16, 5
+
+FAKE_AMPLIGRAPH = {
+    "__init__.py": "",
+    "discovery.py": """
+        def find_nearest_neighbours(model, entities, n_neighbors, metric="cosine"):
+            raise NotImplementedError("the test uses the embeddings store only")
+    """,
+    "utils.py": """
+        import pickle
+
+        class EmbeddingsModel:
+            def __init__(self, ids, vectors):
+                self.ent_to_idx = {article_id: row for row, article_id in enumerate(ids)}
+                self.vectors = vectors
+
+            def get_embeddings(self, entities):
+                return self.vectors[[self.ent_to_idx[entity] for entity in entities]]
+
+        def restore_model(path):
+            with open(path, "rb") as f:
+                ids, vectors = pickle.load(f)
+            return EmbeddingsModel(ids, vectors)
+    """,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def history_weights(n):
+    weights = np.array([1. / math.log(n - row + 1) for row in range(n)])
+    return weights / weights.sum()
+
+
+def wait_ready(url: str, processes, timeout: float = 120.):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if any(process.poll() is not None for process in processes):
+            pytest.fail("a service process exited during startup")
+        try:
+            # health отвечает кодом статуса в теле
+            if httpx.get(f"{url}/health").json() == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    pytest.fail(f"{url} is not ready in {timeout}s")
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    path = tmp_path_factory.mktemp("sharding")
+    rng = np.random.default_rng(0)
+    ids = [f"{i:024x}" for i in range(N_ARTICLES)]
+    vectors = rng.standard_normal((N_ARTICLES, DIM)).astype(np.float32)
+    write_store(str(path / "store"), ids, vectors)
+    with open(path / "model.pkl", "wb") as f:
+        pickle.dump((ids, vectors), f)
+    package = path / "fakes" / "ampligraph"
+    package.mkdir(parents=True)
+    for name, source in FAKE_AMPLIGRAPH.items():
+        (package / name).write_text(textwrap.dedent(source))
+    return path, ids, vectors
+
+
+@pytest.fixture(scope="module")
+def coordinator(corpus):
+    path, _, _ = corpus
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([str(path / "fakes"), RECSYS_DIR, REPO_DIR]),
+        MODEL_PATH=str(path / "model.pkl"),
+        ARTICLE_EMBED_STORE=str(path / "store"),
+        AUTHOR_EMBED_STORE=str(path / "no_authors"),
+        ARTIFACT_OFFLINE="1",
+    )
+    port = free_port()
+    processes, url = launch(2, port, env)
+    # шарды слушают порты сразу за портом координатора
+    urls = [url] + [f"http://127.0.0.1:{port + 1 + shard_id}" for shard_id in range(2)]
+    try:
+        for service_url in urls:
+            wait_ready(service_url, processes)
+        yield url
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+
+def exact_neighbors(ids, vectors, history):
+    index = EmbeddingIndex(ids, vectors)
+    rows = [ids.index(article_id) for article_id in history]
+    query = np.average(vectors[rows], axis=0, weights=history_weights(len(rows)))
+    neighbors, _ = index.search(query, K, exclude=history)
+    return neighbors.tolist()
+
+
+@pytest.mark.parametrize("history_size", [1, 3])
+def test_merged_neighbors_match_exact_search(corpus, coordinator, history_size):
+    _, ids, vectors = corpus
+    rng = np.random.default_rng(history_size)
+    for _ in range(5):
+        history = [ids[row] for row in rng.choice(N_ARTICLES, size=history_size, replace=False)]
+        response = httpx.post(f"{coordinator}/get_neighbors", json={"id": history}, timeout=30)
+        response.raise_for_status()
+        assert response.json()["neighbors"] == exact_neighbors(ids, vectors, history)